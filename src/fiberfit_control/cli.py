@@ -0,0 +1,296 @@
+#!/usr/local/bin/python3
+
+"""Headless (command line) modes of FiberFit. None of them needs Qt or a display.
+
+Usage:
+    python src/fiberfit_control/cli.py enqueue QUEUE IMAGE [IMAGE ...]
+    python src/fiberfit_control/cli.py worker QUEUE OUTPUT_DIR [settings]
+    python src/fiberfit_control/cli.py merge OUTPUT_DIR
+    python src/fiberfit_control/cli.py serve [--port PORT]
+    python src/fiberfit_control/cli.py report RESULTS REPORT.pdf
+    python src/fiberfit_control/cli.py benchmark OUTPUT.csv [--sizes SIZE ...] [--k K ...]
+    python src/fiberfit_control/cli.py bands OUTPUT.csv IMAGE [IMAGE ...] [--bands N | --edges RADIUS ...]
+    python src/fiberfit_control/cli.py sequence OUTPUT.csv FRAMES [FRAMES ...] [--fps FPS]
+"""
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+"3rd party imports: "
+import argparse
+import csv
+import pathlib
+import matplotlib
+matplotlib.use("Agg")  # no display needed
+import numpy as np
+
+"custom file imports"
+from src.fiberfit_model import computerVision_BP
+from src.fiberfit_model import preprocessing
+from src.fiberfit_control.support import analysis
+from src.fiberfit_control.support import benchmark
+from src.fiberfit_control.support import preflight
+from src.fiberfit_control.support import report_writer
+from src.fiberfit_control.support import service
+from src.fiberfit_control.support import telemetry
+from src.fiberfit_control.support import time_series
+from src.fiberfit_control.support import work_queue
+
+
+def add_settings_arguments(parser):
+    """
+    Adds the scientific parameters (same defaults as settings.SettingsWindow) to a sub-command.
+    """
+    parser.add_argument('--ucut', type=float, default=2.0, help='upper cutoff')
+    parser.add_argument('--lcut', type=float, default=32.0, help='lower cutoff')
+    parser.add_argument('--angle-inc', type=float, default=1.0, help='angle increment (degrees)')
+    parser.add_argument('--rad-step', type=float, default=0.5, help='radial step (pixels)')
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='REPLICATES',
+                        help='compute bootstrap confidence intervals of k and mu (e.g. 1000), 0 for none')
+    parser.add_argument('--mixture', type=int, default=0, metavar='COMPONENTS',
+                        help='also fit a mixture of up to this many von Mises components, e.g. for crossing '
+                             'fibers (the number is picked per image), 0 for none')
+    add_histogram_argument(parser)
+    add_preprocessing_arguments(parser)
+
+
+def add_histogram_argument(parser, nargs=None):
+    default = 'spline' if nargs is None else ['spline']
+    parser.add_argument('--histogram', choices=sorted(computerVision_BP.HISTOGRAM_ENGINES), nargs=nargs,
+                        default=default,
+                        help='how to compute the angular distribution: spline (interpolated rays, the original), '
+                             'adaptive (fewer rays, faster at fine angle increments) or bincount (binned pixels, '
+                             'fastest, see README)')
+
+
+def add_preprocessing_arguments(parser):
+    """
+    Adds how the images are brought to an FFT-friendly size and transformed (see preprocessing.conform_image and
+    computerVision_BP.spectrum_dtype) to a sub-command.
+    """
+    parser.add_argument('--mode', choices=preprocessing.MODES, default='auto',
+                        help='auto keeps every pixel (square images as they are, others padded), crop and pad also '
+                             'bring the side to a fast FFT length')
+    parser.add_argument('--window', choices=[window for window in preprocessing.WINDOWS if window], default=None,
+                        help='apodize the images before the FFT')
+    parser.add_argument('--precision', choices=['float32', 'float64'], default=None,
+                        help='precision of the spectrum, by default float64 unless --memory-cap calls for float32')
+    parser.add_argument('--memory-cap', type=float, default=None, metavar='MB',
+                        help='largest size of the spectrum of one image (MB)')
+
+
+def memory_cap(args):
+    """
+    Returns: --memory-cap in bytes, None for no limit
+    """
+    return None if args.memory_cap is None else int(args.memory_cap * 2 ** 20)
+
+
+def add_events_argument(parser):
+    parser.add_argument('--events', default=None, metavar='SINK',
+                        help='write progress events as JSON lines to a file, - (stdout), tcp://host:port or '
+                             'udp://host:port')
+
+
+def enqueue(args):
+    images, rejected, notes = preflight.check_files(args.images)
+    problems = preflight.summary(rejected, notes)
+    if problems:
+        print(problems)
+    queue = work_queue.JobQueue(args.queue)
+    added = queue.enqueue(os.path.abspath(path) for path in images)
+    print("Queued {added} new image(s): {counts}".format(added=added, counts=queue.counts()))
+    queue.close()
+
+
+def worker(args):
+    worker_id = args.worker_id or work_queue.default_worker_id()
+    processed = work_queue.run_worker(args.queue, args.output, args.ucut, args.lcut, args.angle_inc, args.rad_step,
+                                      worker=worker_id, lease_seconds=args.lease,
+                                      max_attempts=args.max_attempts, poll_interval=args.poll,
+                                      bootstrap=args.bootstrap, engine=args.histogram, mixture=args.mixture,
+                                      events=telemetry.EventStream(args.events, source=worker_id), mode=args.mode,
+                                      window=args.window, precision=args.precision, memory_cap=memory_cap(args))
+    print("Processed {processed} image(s).".format(processed=processed))
+
+
+def merge(args):
+    records = work_queue.merge_shards(args.output, args.summary)
+    print("Merged {count} result(s).".format(count=len(records)))
+    if args.queue:
+        queue = work_queue.JobQueue(args.queue)
+        for path, error in queue.failures():
+            print("FAILED: {path}: {error}".format(path=path, error=error))
+        queue.close()
+
+
+def serve(args):
+    service.serve(args.host, args.port, args.workers, args.max_pending, args.timeout, args.work_dir, args.events,
+                  args.image_root, args.mode, args.window, args.precision, memory_cap(args))
+
+
+def report(args):
+    results = args.results
+    if os.path.isdir(results):
+        results = os.path.join(results, 'results.jsonl')
+    records = work_queue.read_records(results)
+    if args.html:
+        report_writer.write_html(records, args.output)
+    else:
+        report_writer.write_pdf(records, args.output, args.workers)
+    print("Wrote the report of {count} image(s) to {output}".format(count=len(records), output=args.output))
+
+
+def run_benchmark(args):
+    cases = benchmark.build_cases(args.sizes, args.k, args.noise, args.ucut, args.lcut, args.angle_inc, args.rad_step,
+                                  args.histogram, args.mu)
+    rows = benchmark.run_benchmark(cases, args.output, args.repeats, args.seed, args.precision)
+    print("Wrote {count} case(s) to {output}".format(count=len(rows), output=args.output))
+    if args.baseline:
+        regressions = benchmark.find_regressions(rows, benchmark.read_rows(args.baseline), args.tolerance)
+        for regression in regressions:
+            print("SLOWER: " + regression)
+        if regressions:
+            sys.exit(1)
+
+
+def run_bands(args):
+    bands = args.edges if args.edges else args.bands
+    with open(args.output, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(analysis.BAND_HEADER)
+        for path in args.images:
+            filename = pathlib.Path(path)
+            rows, normPower, theta, edges = analysis.analyze_bands_file(filename, args.ucut, args.lcut,
+                                                                        args.angle_inc, args.rad_step, bands,
+                                                                        mode=args.mode, window=args.window,
+                                                                        precision=args.precision,
+                                                                        memory_cap=memory_cap(args))
+            writer.writerows(rows)
+            if args.matrix:
+                write_band_matrix(os.path.join(args.matrix, filename.stem + '_bands.csv'), normPower, theta, edges)
+    print("Wrote the bands of {count} image(s) to {output}".format(count=len(args.images), output=args.output))
+
+
+def write_band_matrix(path, normPower, theta, edges):
+    """
+    Writes the band x angle matrix of angular distributions: one row per band, one column per angle (degrees).
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Inner Radius', 'Outer Radius'] + [round(angle, 6) for angle in np.degrees(theta)])
+        for band, bandPower in enumerate(normPower):
+            writer.writerow([edges[band], edges[band + 1]] + list(bandPower))
+
+
+def run_sequence(args):
+    frames = time_series.write_time_series(args.frames, args.output, args.ucut, args.lcut, args.angle_inc,
+                                           args.rad_step, args.histogram, args.fps,
+                                           telemetry.EventStream(args.events), args.mode, args.window,
+                                           args.precision, memory_cap(args))
+    print("Wrote the time series of {frames} frame(s) to {output}".format(frames=frames, output=args.output))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='fiberfit', description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    sub = commands.add_parser('enqueue', help='add images to a shared job queue')
+    sub.add_argument('queue', help='path to the queue database on the shared filesystem')
+    sub.add_argument('images', nargs='+')
+    sub.set_defaults(func=enqueue)
+
+    sub = commands.add_parser('worker', help='process images from a shared job queue')
+    sub.add_argument('queue', help='path to the queue database on the shared filesystem')
+    sub.add_argument('output', help='shared directory for the result shards and secondary images')
+    add_settings_arguments(sub)
+    sub.add_argument('--worker-id', default=None, help='defaults to <hostname>-<pid>')
+    sub.add_argument('--lease', type=float, default=600, help='seconds a job may take before it is handed out again')
+    sub.add_argument('--max-attempts', type=int, default=3)
+    sub.add_argument('--poll', type=float, default=5.0, help='seconds to wait while other workers hold the leases')
+    add_events_argument(sub)
+    sub.set_defaults(func=worker)
+
+    sub = commands.add_parser('merge', help='merge the result shards of all workers')
+    sub.add_argument('output', help='directory with the result shards')
+    sub.add_argument('--summary', default=None, help='path of the summary csv, OUTPUT/summary.csv by default')
+    sub.add_argument('--queue', default=None, help='report the failed jobs of this queue')
+    sub.set_defaults(func=merge)
+
+    sub = commands.add_parser('serve', help='answer analysis requests over HTTP')
+    sub.add_argument('--host', default='127.0.0.1')
+    sub.add_argument('--port', type=int, default=8765)
+    sub.add_argument('--workers', type=int, default=None, help='worker processes, defaults to the number of CPUs')
+    sub.add_argument('--max-pending', type=int, default=32, help='requests that may wait for a worker')
+    sub.add_argument('--timeout', type=float, default=120.0, help='seconds a request may take')
+    sub.add_argument('--work-dir', default=None, help='scratch directory for uploads and secondary images')
+    sub.add_argument('--image-root', default=None, metavar='DIR',
+                     help='also analyze images named by "path" in a request, if they are inside DIR')
+    add_preprocessing_arguments(sub)
+    add_events_argument(sub)
+    sub.set_defaults(func=serve)
+
+    sub = commands.add_parser('report', help='write the report of processed images, without Qt')
+    sub.add_argument('results', help='results.jsonl written by merge, or the directory containing it')
+    sub.add_argument('output', help='path of the PDF, or the directory of the HTML bundle with --html')
+    sub.add_argument('--html', action='store_true', help='write a static HTML bundle instead of a PDF')
+    sub.add_argument('--workers', type=int, default=None, help='processes rendering pages, defaults to the CPUs')
+    sub.set_defaults(func=report)
+
+    sub = commands.add_parser('benchmark', help='time the analysis stages on synthetic images of varying size')
+    sub.add_argument('output', help='path of the csv file with one row per case')
+    sub.add_argument('--sizes', type=int, nargs='+', default=[256, 512, 1024, 2048], help='image sizes (pixels)')
+    sub.add_argument('--k', type=float, nargs='+', default=[1.0, 4.0], help='orientation concentrations')
+    sub.add_argument('--noise', type=float, nargs='+', default=[0.0], help='noise levels, relative to the fibers')
+    sub.add_argument('--mu', type=float, default=90.0, help='orientation of the fibers (degrees)')
+    sub.add_argument('--ucut', type=float, nargs='+', default=[2.0], help='upper cutoffs')
+    sub.add_argument('--lcut', type=float, nargs='+', default=[32.0], help='lower cutoffs')
+    sub.add_argument('--angle-inc', type=float, nargs='+', default=[1.0], help='angle increments (degrees)')
+    sub.add_argument('--rad-step', type=float, nargs='+', default=[0.5], help='radial steps (pixels)')
+    add_histogram_argument(sub, nargs='+')
+    sub.add_argument('--repeats', type=int, default=3, help='timed runs per case, the fastest is kept')
+    sub.add_argument('--seed', type=int, default=0, help='seed of the synthetic images')
+    sub.add_argument('--precision', choices=['float32', 'float64'], default=None, help='precision of the spectrum')
+    sub.add_argument('--baseline', default=None, help='csv of an earlier run; exit with 1 if a stage got slower')
+    sub.add_argument('--tolerance', type=float, default=0.25, help='relative slowdown tolerated by --baseline')
+    sub.set_defaults(func=run_benchmark)
+
+    sub = commands.add_parser('bands', help='fit mu and k in several frequency sub-bands of every image')
+    sub.add_argument('output', help='path of the csv file with one row per image and band')
+    sub.add_argument('images', nargs='+')
+    sub.add_argument('--ucut', type=float, default=2.0, help='upper cutoff')
+    sub.add_argument('--lcut', type=float, default=32.0, help='lower cutoff')
+    sub.add_argument('--angle-inc', type=float, default=1.0, help='angle increment (degrees)')
+    sub.add_argument('--rad-step', type=float, default=0.5, help='radial step (pixels)')
+    sub.add_argument('--bands', type=int, default=4, help='number of equally wide sub-bands of the cutoffs')
+    sub.add_argument('--edges', type=float, nargs='+', default=None, metavar='RADIUS',
+                     help='radii of the band edges, instead of --bands')
+    sub.add_argument('--matrix', default=None, metavar='DIR',
+                     help='also write the band x angle distributions of every image to DIR/<name>_bands.csv')
+    add_preprocessing_arguments(sub)
+    sub.set_defaults(func=run_bands)
+
+    sub = commands.add_parser('sequence', help='analyze a time-lapse series or video frame by frame')
+    sub.add_argument('output', help='path of the csv file with one row per frame, written as the frames are done')
+    sub.add_argument('frames', nargs='+', help='images in order, multi-frame TIFF/GIF files or videos')
+    sub.add_argument('--ucut', type=float, default=2.0, help='upper cutoff')
+    sub.add_argument('--lcut', type=float, default=32.0, help='lower cutoff')
+    sub.add_argument('--angle-inc', type=float, default=1.0, help='angle increment (degrees)')
+    sub.add_argument('--rad-step', type=float, default=0.5, help='radial step (pixels)')
+    add_histogram_argument(sub)
+    sub.add_argument('--fps', type=float, default=None,
+                     help='frames per second for the Time column, by default that of the video')
+    add_preprocessing_arguments(sub)
+    add_events_argument(sub)
+    sub.set_defaults(func=run_sequence)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,6 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
 "3rd party imports: "
 import pathlib
 import sys
-import datetime
 import matplotlib
 import threading
 import time
@@ -16,7 +15,6 @@ from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from PyQt5 import QtWidgets
 from PyQt5.Qt import *
 from PyQt5.QtWidgets import QFileDialog  # In order to select a file
-import base64
 from PyQt5.QtCore import pyqtSlot, pyqtSignal
 from PyQt5.QtWidgets import QDesktopWidget
 import random
@@ -27,14 +25,17 @@ import shutil
 "custom file imports"
 from src.fiberfit_gui import fiberfit_GUI
 from src.fiberfit_model import computerVision_BP
+from src.fiberfit_model import spectrum_cache
 from src.fiberfit_control.support import img_model
 from src.fiberfit_control.support import settings
 from src.fiberfit_control.support import error
+from src.fiberfit_control.support import image_list
 from src.fiberfit_control.support import report
-
-class OrderedSet(set):
-    def __init__(self):
-        super(OrderedSet, self).__init__()
+from src.fiberfit_control.support import analysis
+from src.fiberfit_control.support import pipeline
+from src.fiberfit_control.support import preflight
+from src.fiberfit_control.support import result_bus
+from src.fiberfit_control.support import telemetry
 
 class fft_mainWindow(fiberfit_GUI.Ui_MainWindow, QtWidgets.QMainWindow):
     """Controller part of the application.
@@ -48,10 +49,11 @@ class fft_mainWindow(fiberfit_GUI.Ui_MainWindow, QtWidgets.QMainWindow):
         signals:
             go_export: sends an img_model to src.fiberfit_control.support.report
             go_run: signals starting of the thread
-            go_update: signals to update labels and populate combo box
-            send_data_to_report: sends data to src.fiberfit_control.support_report
+            go_update: signals to update labels and select the image in the combo box
             go_process_iamges: signals to do final touches after image was processed by the computerVision_BP
             send_error: signals that something went wrong
+            go_preview: signals that a low-resolution preview of the image being processed is ready
+            go_refit: signals that an image was re-analyzed in the background after the settings changed
         vars:
             data_list: contains a list of already processed images. helps src.fiberfit_control.support.report remember
                 which images have already been processed.
@@ -59,47 +61,77 @@ class fft_mainWindow(fiberfit_GUI.Ui_MainWindow, QtWidgets.QMainWindow):
             dpi: dots-per-inch of the screen
             selected_files: target files that user selected
             current_index: index of currently selected image
+            imgList: image_list.ImageCollection of the processed images
+            image_list_model: image_list.ImageListModel of imgList, shown by the combo box
             settings_browser: a settings QDialog
             error_browser: error QDialog
             runtime: measures time taken to perform computerVision_BP
             is_resized: indicates if user already resized image to his/her preference
             is_started: shows whether program analyzed an image already or not
+            is_progressive: whether large images are previewed at low resolution before the full result arrives
+            is_previewing: shows whether the canvas currently displays a preview
+            bootstrap_replicates: number of bootstrap replicates for the confidence intervals of k and mu, 0 for none
+                (set in the settings dialog)
             run_counter: how many rounds the program ran (useful when needed to name saved png images)
+            spectrum_cache: bounded cache of the power spectra of the loaded images, used to apply setting changes
+            analysis_lock: serializes the RefitThreads, so that a later one does not overtake an earlier one (they
+                write the same secondary image files)
+            refit_thread: the RefitThread applying the latest settings, or None
+            runs_in_progress: number of MyThread runs that have not finished yet
+            pending_settings: settings applied while a run was in progress, (u_cut, l_cut, angle_inc, rad_step,
+                replicates), which take effect once the runs are done; None if there are none
+            event_stream: progress events of the runs, written to the sink named by FIBERFIT_EVENTS (see telemetry)
+            result_bus: publishes new and changed results to the report (see result_bus)
     """
 
     go_export = pyqtSignal(img_model.ImgModel)
     go_run = pyqtSignal()
     # Args: int index of the image in the imgList
     go_update = pyqtSignal(int)
-    # Args: list of currently processed images, data list from the report.py, list of all the images (both processed
-    # currently and in the past), u_cut, l_cut, rad_step, angle_inc
-    send_data_to_report = pyqtSignal(list, list, OrderedSet, float, float, float, float)
     # Args: number of images to be processed, the most recent processed image, list of currently processed images,
     # 1/0 whether processed images was the last one or not, running time, number indicating order of the image.
     go_process_images = pyqtSignal(int, img_model.ImgModel, list, int, int, int)
     # Args: list of names of the files to be processed, number indicating order of the image (useful when indexing to the
     # name of the file), 1/0 depending on what type of error occured.
     send_error = pyqtSignal(list, int, int)
+    # Args: approximate result for the image that is being processed, computed from a downsampled copy.
+    go_preview = pyqtSignal(img_model.ImgModel)
+    # Args: result of an already processed image, re-analyzed with new settings.
+    go_refit = pyqtSignal(img_model.ImgModel)
+    # emitted by a MyThread when it is done with all of its files
+    go_run_finished = pyqtSignal()
 
     def __init__(self, Parent=None):
         """
         Initializes all instance variables a.k.a attributes of a class.
         """
         super(fft_mainWindow, self).__init__()
-        self.imgList = OrderedSet()
+        self.imgList = image_list.ImageCollection()
         # Stuff I looked at
         self.screen_dim, self.dpi = self.receive_dim()
         self.setupUi(self, self.screen_dim.height(), self.screen_dim.width())
+        self.image_list_model = image_list.ImageListModel(self.imgList, self)
+        self.selectImgBox.setModel(self.image_list_model)
+        self.selectImgBox.view().setUniformItemSizes(True)
         self.data_list = []
         self.selected_files = []
         self.current_index = 0
         self.runtime = 0
         self.is_resized = False
         self.is_started = False
+        self.is_progressive = True
+        self.is_previewing = False
         self.saved_images_dir_name = ''
         self.run_counter = 0  # I need it to be able to process multiple images.
+        self.spectrum_cache = spectrum_cache.SpectrumCache()
+        self.analysis_lock = threading.Lock()
+        self.refit_thread = None
+        self.runs_in_progress = 0
+        self.pending_settings = None
+        self.event_stream = telemetry.EventStream(os.environ.get('FIBERFIT_EVENTS'))
         self.settings_browser = settings.SettingsWindow(self, self.screen_dim)
         self.error_browser = error.ErrorDialog(self, self.screen_dim)
+        self.result_bus = result_bus.ResultBus(self.imgList)
         self.report_dialog = report.ReportDialog(self, self, self.screen_dim)
 
         # model settings
@@ -107,6 +139,7 @@ class fft_mainWindow(fiberfit_GUI.Ui_MainWindow, QtWidgets.QMainWindow):
         self.l_cut = float(self.settings_browser.tbottomField.text())
         self.angle_inc = float(self.settings_browser.btopField.text())
         self.rad_step = float(self.settings_browser.bbottomField.text())
+        self.bootstrap_replicates = int(self.settings_browser.replicatesField.text())
 
         self.img_canvas = None
         self.log_scl_canvas = None
@@ -150,13 +183,38 @@ Please go back to "Settings" and change some values.
         Starts a thread that does the heavy-lifting computerVision algorithm
         :return: none
         """
-        pThread = MyThread(self.go_process_images, self.send_error, self.progressBar, self.saved_images_dir_name, self.run_counter)
-        pThread.update_values(self.u_cut, self.l_cut, self.angle_inc, self.rad_step, self.screen_dim, self.dpi, self.selected_files)
-        if len(self.selected_files) != 0:
-            self.progressBar.show()
-            self.progressBar.setValue(0)
+        # the headers of the whole selection are checked before any image is decoded, and the files that can not be
+        # processed are reported together and left out
+        self.selected_files, rejected, notes = preflight.check_files(self.selected_files, self.l_cut)
+        problems = preflight.summary(rejected, notes)
+        if problems:
+            self.error_browser.label.setText(problems)
+            self.error_browser.show()
+        if len(self.selected_files) == 0:
+            return
+        self.progressBar.setMaximum(len(self.selected_files))
+        pThread = MyThread(self.go_process_images, self.send_error, self.progressBar, self.saved_images_dir_name,
+                           self.run_counter, self.go_preview, self.spectrum_cache, self.event_stream,
+                           self.go_run_finished)
+        pThread.update_values(self.u_cut, self.l_cut, self.angle_inc, self.rad_step, self.screen_dim, self.dpi,
+                              self.selected_files, self.is_progressive, self.bootstrap_replicates)
+        self.progressBar.show()
+        self.progressBar.setValue(0)
+        self.runs_in_progress += 1
         pThread.start()
 
+    @pyqtSlot()
+    def run_finished(self):
+        """
+        Takes note that a MyThread is done, and applies the settings that were applied while the runs were in
+        progress once the last one is.
+        """
+        self.runs_in_progress -= 1
+        if self.runs_in_progress == 0 and self.pending_settings is not None:
+            values, self.pending_settings = self.pending_settings, None
+            self.update_values(*values)
+            self.apply_settings(*values)
+
     @pyqtSlot()
     def export(self):
         """
@@ -184,13 +242,16 @@ Please go back to "Settings" and change some values.
             self.clean_canvas()
             self.progressBar.hide()
             self.selected_files.clear()
-            # clears combo-box
-            self.selectImgBox.clear()
             # resets isStarted
             self.is_started = False
+            self.is_previewing = False
             self.data_list.clear()
-            # empties all images
-            self.imgList.clear()
+            self.spectrum_cache.clear()
+            # empties all images, and the combo box and the report with them
+            self.image_list_model.clear()
+            self.result_bus.reset()
+            if self.refit_thread is not None:
+                self.refit_thread.cancel()
             # resets current index
             self.current_index = 0
             shutil.rmtree(self.saved_images_dir_name)
@@ -228,24 +289,16 @@ Please go back to "Settings" and change some values.
         # because I needed a way to name images
         self.run_counter = number
 
-        # Ordered Set
-        if processed_image in self.imgList:
-            self.imgList.remove(processed_image)
-            self.imgList.add(processed_image)
-        else:
-            self.imgList.add(processed_image)
-        self.send_data_to_report.emit(processed_images_list, self.data_list, self.imgList, self.u_cut, self.l_cut, self.rad_step,
-                                      self.angle_inc)
+        # an image that was processed before keeps its row
+        self.current_index = self.image_list_model.add(processed_image)
+        self.result_bus.publish(processed_image, self.report_settings())
 
-        if self.is_started:
+        if self.is_started or self.is_previewing:
             # removes/deletes all canvases
             self.clean_canvas()
+        self.is_previewing = False
         # fills canvas
-        try:
-            self.fill_canvas(self.imgList.__getitem__(self.current_index))
-        except IndexError:
-            self.current_index -= 1
-            self.fill_canvas(self.imgList.__getitem__(self.current_index))
+        self.fill_canvas(self.imgList.__getitem__(self.current_index))
 
         if not self.is_resized:
             self.apply_resizing()
@@ -258,7 +311,6 @@ Please go back to "Settings" and change some values.
         #  Setting progress bar business
         self.progressBar.setValue(count)
         self.progressBar.valueChanged.emit(self.progressBar.value())
-        self.current_index += 1
         self.runtime += time
 
     def apply_resizing(self):
@@ -273,15 +325,14 @@ Please go back to "Settings" and change some values.
         sizePolicy.setHeightForWidth(self.figureWidget.sizePolicy().hasHeightForWidth())
         self.figureWidget.setSizePolicy(sizePolicy)
 
-    @pyqtSlot()
-    def populate_combo_box(self):
+    @pyqtSlot(int)
+    def select_in_combo_box(self, index):
         """
-        Populates combox box with the names.
+        Selects an image in the combo box. The box shows image_list_model, which already has the names.
+        :param index: index of the image in the imgList
         """
-        self.selectImgBox.clear()
-        for element in self.imgList:
-            self.selectImgBox.addItem(element.filename.stem)
-        self.selectImgBox.setCurrentIndex(self.current_index)
+        self.image_list_model.ensure_loaded(index)
+        self.selectImgBox.setCurrentIndex(index)
 
     def clean_canvas(self):
         """
@@ -296,34 +347,56 @@ Please go back to "Settings" and change some values.
         self.img_canvas.deleteLater()
         self.log_scl_canvas.deleteLater()
 
-    def fill_canvas(self, img):
+    @pyqtSlot(img_model.ImgModel)
+    def show_preview(self, preview):
+        """
+        Displays the approximate result of the image that is being processed until its full result arrives.
+        Args:
+            preview: img_model of the downsampled image
+        """
+        if self.is_started or self.is_previewing:
+            self.clean_canvas()
+        self.fill_canvas(preview, self.saved_images_dir_name + "/preview")
+        self.is_previewing = True
+        if not self.is_resized:
+            self.apply_resizing()
+            self.is_resized = True
+        self.sigLabel.setText("σ ≈ " + str(round(preview.sig[0], 2)))
+        self.kLabel.setText("k ≈ " + str(round(preview.k, 2)))
+        self.muLabel.setText("μ ≈ " + str(round(preview.th, 2)))
+        self.RLabel.setText(('R' + u"\u00B2") + " ≈ " + str(round(preview.R2, 2)))
+
+    def fill_canvas(self, img, directory=None):
         """
         Fills the canvas with the FFT-processed results based on the img.
         :param img: img to be processed
+        :param directory: directory containing the secondary images, saved_images_dir_name by default
         """
+        if directory is None:
+            directory = self.saved_images_dir_name
         # updates canvases
 
         # upper-left tile
         self.img_canvas = QtWidgets.QLabel()
-        self.img_canvas.setPixmap(QPixmap(self.saved_images_dir_name + "/orgImg_" + img.number.__str__() + ".png").scaled(300, 400, Qt.KeepAspectRatio, Qt.SmoothTransformation))
+        self.img_canvas.setPixmap(QPixmap(directory + "/orgImg_" + img.number.__str__() + ".png").scaled(300, 400, Qt.KeepAspectRatio, Qt.SmoothTransformation))
         self.img_canvas.setScaledContents(True)
         self.img_canvas.setSizePolicy(QtWidgets.QSizePolicy.Ignored, QtWidgets.QSizePolicy.Ignored)
 
         # upper-right tile
         self.log_scl_canvas = QtWidgets.QLabel()
-        self.log_scl_canvas.setPixmap(QPixmap(self.saved_images_dir_name + "/logScl_" + img.number.__str__() + ".png").scaled(300, 400, Qt.KeepAspectRatio, Qt.SmoothTransformation))
+        self.log_scl_canvas.setPixmap(QPixmap(directory + "/logScl_" + img.number.__str__() + ".png").scaled(300, 400, Qt.KeepAspectRatio, Qt.SmoothTransformation))
         self.log_scl_canvas.setScaledContents(True)
         self.log_scl_canvas.setSizePolicy(QtWidgets.QSizePolicy.Ignored, QtWidgets.QSizePolicy.Ignored)
 
         # lower-left tile
         self.ang_dist_canvas = QtWidgets.QLabel()
-        self.ang_dist_canvas.setPixmap(QPixmap(self.saved_images_dir_name + "/angDist_" + img.number.__str__() + ".png").scaled(300, 400, Qt.KeepAspectRatio, Qt.SmoothTransformation))
+        self.ang_dist_canvas.setPixmap(QPixmap(directory + "/angDist_" + img.number.__str__() + ".png").scaled(300, 400, Qt.KeepAspectRatio, Qt.SmoothTransformation))
         self.ang_dist_canvas.setScaledContents(True)
         self.ang_dist_canvas.setSizePolicy(QtWidgets.QSizePolicy.Ignored, QtWidgets.QSizePolicy.Ignored)
 
         # lower-right tile
         self.cart_dist_canvas = QtWidgets.QLabel()
-        self.cart_dist_canvas.setPixmap(QPixmap(self.saved_images_dir_name + "/cartDist_" + img.number.__str__() + ".png").scaled(300, 400, Qt.KeepAspectRatio, Qt.SmoothTransformation))
+        self.cart_dist_canvas.setPixmap(QPixmap(directory + "/cartDist_" + img.number.__str__() + ".png").scaled(300, 400, Qt.KeepAspectRatio, Qt.SmoothTransformation))
         self.cart_dist_canvas.setScaledContents(True)
         self.cart_dist_canvas.setSizePolicy(QtWidgets.QSizePolicy.Ignored, QtWidgets.QSizePolicy.Ignored)
 
@@ -357,12 +430,13 @@ Please go back to "Settings" and change some values.
         self.sigLabel.setText("σ = ")
         # clears canvas
         self.clean_canvas()
-        # clears combo-box
-        self.selectImgBox.clear()
         # resets isStarted
         self.is_started = False
-        # empties all images
-        self.imgList.clear()
+        # empties all images, and the combo box and the report with them
+        self.image_list_model.clear()
+        self.result_bus.reset()
+        if self.refit_thread is not None:
+            self.refit_thread.cancel()
         # resets current index
         self.current_index = 0
         self.go_run.emit()
@@ -392,7 +466,7 @@ Please go back to "Settings" and change some values.
             self.clean_canvas()
             self.fill_canvas(image)
             self.setup_labels((self.current_index))
-            self.selectImgBox.setCurrentIndex(self.current_index)
+            self.select_in_combo_box(self.current_index)
 
     def prev_image(self):
         """
@@ -407,33 +481,138 @@ Please go back to "Settings" and change some values.
             self.clean_canvas()
             self.fill_canvas(image)
             self.setup_labels(self.current_index)
-            self.selectImgBox.setCurrentIndex(self.current_index)
+            self.select_in_combo_box(self.current_index)
 
-    @pyqtSlot(float, float, float, float)
-    def update_values(self, u_cut, l_cut, angle_inc, rad_step):
+    def report_settings(self):
+        """
+        Returns: the settings in the order the report lists them, (u_cut, l_cut, rad_step, angle_inc)
+        """
+        return self.u_cut, self.l_cut, self.rad_step, self.angle_inc
+
+    @pyqtSlot(float, float, float, float, int)
+    def update_values(self, u_cut, l_cut, angle_inc, rad_step, replicates):
         """Updates settings per user's selection.
             Args:
                 u_cut: upper cut
                 l_cut: lower cut
                 angle_inc: angle increment
                 rad_step: radial step
+                replicates: number of bootstrap replicates for the confidence intervals, 0 for none
         """
+        if self.runs_in_progress:
+            # the running MyThread analyzes the rest of its files with the settings it started with (see run_finished)
+            self.pending_settings = (u_cut, l_cut, angle_inc, rad_step, replicates)
+            return
         self.u_cut = u_cut
         self.l_cut = l_cut
         self.angle_inc = angle_inc
         self.rad_step = rad_step
+        self.bootstrap_replicates = replicates
+
+    @pyqtSlot(float, float, float, float)
+    def preview_settings(self, u_cut, l_cut, angle_inc, rad_step):
+        """Re-analyzes the displayed image with the settings that are being edited, starting from its cached spectrum.
+        Only the histogram, ellipse, kappa and their plots are recomputed, into a scratch img_model and the preview
+        directory; the result of the image is only changed when the settings are applied (see apply_settings). With
+        the applied settings, e.g. when the editing is cancelled, the result of the image is shown again.
+            Args:
+                u_cut: upper cut
+                l_cut: lower cut
+                angle_inc: angle increment
+                rad_step: radial step
+            Returns:
+                whether a preview of the displayed image is shown
+        """
+        if not self.is_started:
+            return False
+        index = self.current_index % len(self.imgList)
+        image = self.imgList.__getitem__(index)
+        if (u_cut, l_cut, angle_inc, rad_step) == (self.u_cut, self.l_cut, self.angle_inc, self.rad_step):
+            self.process_images_from_combo_box(image)
+            self.setup_labels(index)
+            return False
+        entry = self.spectrum_cache.get(str(image.filename))
+        if entry is None:
+            return False
+        preview_dir = self.saved_images_dir_name + "/preview"
+        os.makedirs(preview_dir, exist_ok=True)
+        try:
+            sig, k, th, R2, angDist, cartDist, runtime, normPower, theta = computerVision_BP.analyze_spectrum(
+                entry[0], entry[1], u_cut, l_cut, angle_inc, rad_step, preview_dir, image.number)
+        except (TypeError, ValueError, ZeroDivisionError, RuntimeError):
+            # values out of the input domain, e.g. while they are still being typed in
+            return False
+        preview = img_model.ImgModel(filename=image.filename, sig=sig, k=k, th=th, R2=R2, number=image.number)
+        self.clean_canvas()
+        self.fill_canvas(preview, preview_dir)
+        self.sigLabel.setText("σ = " + str(round(preview.sig[0], 2)))
+        self.kLabel.setText("k = " + str(round(preview.k, 2)))
+        self.muLabel.setText("μ = " + str(round(preview.th, 2)))
+        self.RLabel.setText(('R' + u"\u00B2") + " = " + str(round(preview.R2, 2)))
+        return True
+
+    @pyqtSlot(float, float, float, float, int)
+    def apply_settings(self, u_cut, l_cut, angle_inc, rad_step, replicates):
+        """Applies new settings to all of the loaded images in the background, the displayed one first. Until its new
+        result arrives, the displayed image keeps showing its preview. A RefitThread of earlier settings is cancelled.
+        While images are still being analyzed, the settings are only applied once the run is done (see run_finished),
+        so that all images of the session get the same settings.
+            Args:
+                u_cut: upper cut
+                l_cut: lower cut
+                angle_inc: angle increment
+                rad_step: radial step
+                replicates: number of bootstrap replicates for the confidence intervals, 0 for none
+        """
+        if self.runs_in_progress:
+            self.pending_settings = (u_cut, l_cut, angle_inc, rad_step, replicates)
+            return
+        if not self.is_started:
+            return
+        displayed = self.imgList.__getitem__(self.current_index % len(self.imgList))
+        images = [displayed] + [image for image in self.imgList if image != displayed]
+        if self.refit_thread is not None:
+            self.refit_thread.cancel()
+        self.refit_thread = RefitThread(self.go_refit, self.spectrum_cache, self.analysis_lock,
+                                        self.saved_images_dir_name, images)
+        self.refit_thread.update_values(u_cut, l_cut, angle_inc, rad_step, replicates)
+        self.refit_thread.start()
+
+    @pyqtSlot(img_model.ImgModel)
+    def replace_image(self, refitted):
+        """Takes over the result of an image that was re-analyzed in the background.
+            Args:
+                refitted: the new img_model of an image in imgList
+        """
+        if refitted not in self.imgList:
+            return
+        index = self.imgList.index(refitted)
+        image = self.imgList.__getitem__(index)
+        for attribute in ('sig', 'k', 'th', 'R2', 'angDist', 'angDistEncoded', 'cartDist', 'cartDistEncoded',
+                          'normPower', 'theta', 'kCI', 'thCI'):
+            setattr(image, attribute, getattr(refitted, attribute))
+        if index == self.current_index % len(self.imgList):
+            self.clean_canvas()
+            self.fill_canvas(image)
+            self.setup_labels(index)
+        self.result_bus.publish(image, self.report_settings())
 
     def connect_signals_to_slots(self):
         """Helper function to connect emitted signals to appropriate slots
         """
-        self.send_data_to_report.connect(self.report_dialog.receiver)
+        self.result_bus.subscribe(self.report_dialog.receive_result)
         self.go_export.connect(self.report_dialog.do_test)
         self.go_run.connect(self.runner)
-        self.go_update.connect(self.populate_combo_box)
+        self.go_update.connect(self.select_in_combo_box)
         self.go_update.connect(self.setup_labels)
         self.send_error.connect(self.handle_error)
         self.go_process_images.connect(self.process_images)
+        self.go_preview.connect(self.show_preview)
         self.settings_browser.sendValues.connect(self.update_values)
+        self.settings_browser.sendValues.connect(self.apply_settings)
+        self.settings_browser.previewValues.connect(self.preview_settings)
+        self.go_refit.connect(self.replace_image)
+        self.go_run_finished.connect(self.run_finished)
 
         self.exportButton.clicked.connect(self.export)
         self.startButton.clicked.connect(self.start)
@@ -442,23 +621,17 @@ Please go back to "Settings" and change some values.
         self.loadButton.clicked.connect(self.launch)
         self.clearButton.clicked.connect(self.clear)
         self.settingsButton.clicked.connect(self.settings_browser.do_change)
-        self.selectImgBox.activated[str].connect(self.change_state)
+        self.selectImgBox.activated[int].connect(self.change_state)
 
-    def change_state(self, filename):
+    def change_state(self, index):
         """Changes image according to user's selection via combo box.
             Args:
-                filename: name of which image to change state to
-        """
-        # find img
-        for image in self.imgList:
-            if image.filename.stem == filename:
-                self.process_images_from_combo_box(image)
-                self.sigLabel.setText("σ = " + str(round(image.sig[0], 2)))
-                self.kLabel.setText("k = " + str(round(image.k, 2)))
-                self.muLabel.setText("μ = " + str(round(image.th, 2)))
-                self.RLabel.setText(('R' + u"\u00B2") + " = " + str(round(image.R2, 2)))
-                # sets current index to the index of the found image.
-                self.current_index = self.imgList.index(image)
+                index: row of the selected image, which is its index in the imgList
+        """
+        image = self.imgList.__getitem__(index)
+        self.process_images_from_combo_box(image)
+        self.setup_labels(index)
+        self.current_index = index
 
     def create_temp_dir(self):
         """Creates a directory to where app would dump all the processed images for canvases.
@@ -506,12 +679,99 @@ Please go back to "Settings" and change some values.
             # means directory has not been created. if usre opens an app and then immediately closes it.
 
 
+class RefitThread(threading.Thread):
+    """
+    Re-analyzes already processed images with new settings, starting from their cached spectra.
+    """
+    def __init__(self, sig, cache, lock, dir, images):
+        """
+        Args:
+            sig: go_refit signal from the fft_mainWindow
+            cache: spectrum_cache.SpectrumCache of the fft_mainWindow
+            lock: analysis_lock of the fft_mainWindow
+            dir: full path to directory where to put the secondary images in
+            images: img_models to re-analyze
+        """
+        super(RefitThread, self).__init__()
+        self.sig = sig
+        self.cache = cache
+        self.lock = lock
+        self.directory = dir
+        self.images = images
+        self.u_cut = 0
+        self.l_cut = 0
+        self.angle_inc = 0
+        self.rad_step = 0
+        self.bootstrap = 0
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        """
+        Stops the re-analysis after the current image; the results of images not sent yet are dropped.
+        """
+        self.cancelled.set()
+
+    def update_values(self, u_cut, l_cut, angle_inc, rad_step, bootstrap=0):
+        """
+        Args:
+            u_cut: upper cut
+            l_cut: lower cut
+            angle_inc: angle increment
+            rad_step: radial step
+            bootstrap: number of bootstrap replicates for the confidence intervals, 0 for none
+        """
+        self.u_cut = u_cut
+        self.l_cut = l_cut
+        self.angle_inc = angle_inc
+        self.rad_step = rad_step
+        self.bootstrap = bootstrap
+
+    def run(self):
+        """
+        Re-analyzes the images one by one and sends each result back to the fft_mainWindow. Images whose spectrum has
+        been evicted from the cache are read and transformed again.
+        """
+        for image in self.images:
+            key = str(image.filename)
+            try:
+                with self.lock:
+                    if self.cancelled.is_set():
+                        return
+                    entry = self.cache.get(key)
+                    if entry is None:
+                        im = computerVision_BP.read_image(image.filename)
+                        entry = computerVision_BP.power_spectrum(im), im.shape[1]
+                        self.cache.put(key, *entry)
+                    sig, k, th, R2, angDist, cartDist, runtime, normPower, theta = computerVision_BP.analyze_spectrum(
+                        entry[0], entry[1], self.u_cut, self.l_cut, self.angle_inc, self.rad_step, self.directory,
+                        image.number)
+                    refitted = img_model.ImgModel(
+                        filename=image.filename,
+                        sig=sig,
+                        k=k,
+                        th=th,
+                        R2=R2,
+                        angDist=angDist,
+                        angDistEncoded=analysis.encode_secondary_image(self.directory, 'angDist_', image.number),
+                        cartDist=cartDist,
+                        cartDistEncoded=analysis.encode_secondary_image(self.directory, 'cartDist_', image.number),
+                        number=image.number,
+                        normPower=normPower,
+                        theta=theta)
+                    analysis.add_confidence_intervals(refitted, self.bootstrap)
+            except (TypeError, ValueError, OSError, ZeroDivisionError, RuntimeError):
+                continue
+            if self.cancelled.is_set():
+                return
+            self.sig.emit(refitted)
+
+
 class MyThread(threading.Thread):
     # TODO(atulep): fix the logic here. code is quite dirty.
     """
     Class responsible for heavy lifting of computerVision algorithm
     """
-    def __init__(self, sig, error_sig, bar, dir, num):
+    def __init__(self, sig, error_sig, bar, dir, num, preview_sig=None, cache=None, events=None, finished_sig=None):
         """
         Initialises attributes used to process the image via computerVision and send it back to the running application.
         Args:
@@ -520,6 +780,10 @@ class MyThread(threading.Thread):
             bar: the progress bar
             dir: full path to directory where to put the secondary images in
             num: number indicating the order of image being processed (useful in naming the secondary image files.)
+            preview_sig: go_preview signal from the fft_mainWindow
+            cache: spectrum_cache.SpectrumCache to keep the spectra of the processed images in
+            events: telemetry.EventStream to report the progress to
+            finished_sig: go_run_finished signal from the fft_mainWindow, emitted when all files are done
         """
         super(MyThread, self).__init__()
         self.u_cut = 0
@@ -534,8 +798,20 @@ class MyThread(threading.Thread):
         self.error_sig = error_sig
         self.directory = dir
         self.number = num
-
-    def update_values(self, u_cut, l_cut, angle_inc, rad_step, screen_dim, dpi, filenames):
+        self.preview_sig = preview_sig
+        self.cache = cache
+        self.events = events or telemetry.EventStream()
+        self.finished_sig = finished_sig
+        self.progressive = False
+        self.bootstrap = 0
+        # how many images are decoded ahead of, and wait to be sent after, the one being analyzed
+        self.depth = 2
+        self.processedImagesList = []
+        # file whose result the output stage is sending
+        self.sending = None
+
+    def update_values(self, u_cut, l_cut, angle_inc, rad_step, screen_dim, dpi, filenames, progressive=False,
+                      bootstrap=0):
         """
         Updated the values that are modified during the run time (i.e. settings)
         Args:
@@ -546,6 +822,8 @@ class MyThread(threading.Thread):
             screen_dim: dimensions of a screen
             dpi: DPI of a primary screem
             filenames: list of names of files to be processed
+            progressive: whether to send a low-resolution preview of large images first
+            bootstrap: number of bootstrap replicates for the confidence intervals, 0 for none
         """
         self.l_cut = l_cut
         self.u_cut = u_cut
@@ -554,83 +832,121 @@ class MyThread(threading.Thread):
         self.screen_dim = screen_dim
         self.dpi = dpi
         self.filenames = filenames
+        self.progressive = progressive
+        self.bootstrap = bootstrap
+
+    def send_preview(self, filename, im):
+        """
+        Analyzes a downsampled copy of a large image and sends the approximate result to the fft_mainWindow.
+        Args:
+            filename: name of the image
+            im: the full-resolution image
+        """
+        small = computerVision_BP.preview_image(im, self.l_cut)
+        if small is None:
+            return
+        preview_dir = self.directory + "/preview"
+        os.makedirs(preview_dir, exist_ok=True)
+        sig, k, th, R2, angDist, cartDist, logScl, orgImg, figWidth, figHeigth, runtime, normPower, theta = \
+            computerVision_BP.analyze_image(small, self.u_cut, self.l_cut, self.angle_inc, self.rad_step,
+                                            preview_dir, self.number)
+        self.preview_sig.emit(img_model.ImgModel(filename=filename, sig=sig, k=k, th=th, R2=R2, number=self.number))
 
     def run(self):
         """
         Processes the images inside of filenames and sends the result of each image back to the fft_mainWindow.
+        The images are processed in three overlapping stages: the next images are read ahead while the current one is
+        analyzed, and the secondary images of the previous ones are encoded and sent meanwhile (see pipeline).
         :return: none
         """
-        processedImagesList = []
+        self.processedImagesList = []
         count = 0
         toContinue = True
         isZeroException = 0
         isLast = 0
-        for filename in self.filenames:
+        output = pipeline.OutputStage(self.send_result, self.depth)
+        self.events.run_started(total=len(self.filenames))
+        images = pipeline.read_ahead(self.filenames, computerVision_BP.read_image, self.depth)
+        for index, (filename, im, readError) in enumerate(images):
             toContinue = True
+            failure = None
+            queued = len(self.filenames) - index - 1
+            self.events.image_started(filename, queued)
+            start_time = time.time()
+            timings = {}
             # Retrieve Figures from data analysis code
             try:
-                sig, k, th, R2, angDist,  cartDist, logScl,  orgImg,  figWidth, figHeigth, runtime = \
-                    computerVision_BP.process_image(filename, self.u_cut, self.l_cut, self.angle_inc, self.rad_step,
-                                                    self.screen_dim, self.dpi, self.directory, self.number)
-
-                # Starting from Python3, there is a distinction between bytes and str. Thus, I can't use
-                # methods of str on bytes. However I need to do that in order to properly encode the image
-                # into b64. The main thing is that bytes-way produces some improper characters that mess up
-                # the decoding process. Hence, decode(utf-8) translates bytes into str.
-
-                angDistEncoded = base64.encodebytes(open(self.directory + "/" + 'angDist_' + self.number.__str__() + '.png', 'rb').read()).decode('utf-8')
-                cartDistEncoded = base64.encodebytes(open(self.directory + "/" + 'cartDist_' + self.number.__str__() + '.png', 'rb').read()).decode('utf-8')
-                logSclEncoded = base64.encodebytes(open(self.directory + "/" + 'logScl_' + self.number.__str__() + '.png', 'rb').read()).decode('utf-8')
-                orgImgEncoded = base64.encodebytes(open(self.directory + "/" +  'orgImg_' + self.number.__str__() + '.png', 'rb').read()).decode('utf-8')
-
-                processedImage = img_model.ImgModel(
-                    filename=filename,
-                    sig = sig,
-                    k=k,
-                    th=th,
-                    R2=R2,
-                    orgImg=orgImg,
-                    orgImgEncoded=orgImgEncoded,
-                    logScl=logScl,
-                    logSclEncoded=logSclEncoded,
-                    angDist=angDist,
-                    angDistEncoded=angDistEncoded,
-                    cartDist=cartDist,
-                    cartDistEncoded=cartDistEncoded,
-                    timeStamp=datetime.datetime.now().strftime("%A, %d. %B %Y %I:%M%p"),
-                    number=self.number)
+                if readError is not None:
+                    raise readError
+                if self.progressive and self.preview_sig is not None:
+                    self.send_preview(filename, im)
+                processedImage = analysis.analyze_file(filename, self.u_cut, self.l_cut, self.angle_inc,
+                                                       self.rad_step, self.directory, self.number, im=im,
+                                                       cache=self.cache, encode=False, bootstrap=self.bootstrap,
+                                                       timings=timings)
+                runtime = time.time() - start_time
                 self.number += 1
-                processedImagesList.append(processedImage)
                 count += 1
                 if count == len(self.filenames):
                     isLast = 1
 
-            except TypeError:
-                toContinue = False
-            except ValueError:
-                toContinue = False
-            except OSError:
+            except (TypeError, ValueError, OSError) as e:
                 toContinue = False
-            except ZeroDivisionError:
+                failure = e
+            except ZeroDivisionError as e:
                 toContinue = False
+                failure = e
                 isZeroException = 1
 
             finally:
                 if (toContinue):
-                    self.sig.emit(count, processedImage, processedImagesList, isLast, runtime, self.number)
+                    self.events.image_finished(filename, runtime, timings, queued)
+                    output.submit((count, processedImage, isLast, runtime, self.number))
                 else:
-                    self.error_sig.emit(self.filenames, count, isZeroException)
+                    self.events.image_failed(filename, repr(failure), time.time() - start_time, queued)
+                    output.submit((count, None, isZeroException))
+        try:
+            output.close()
+        except Exception:
+            # the output stage failed, e.g. a secondary image could not be encoded; handle_error hides the bar
+            toContinue = False
+            self.error_sig.emit([self.sending], 0, 0)
+        finally:
+            self.events.run_finished()
+            if self.finished_sig is not None:
+                self.finished_sig.emit()
         # hides the bar after processing all the images
         if toContinue:
             time.sleep(0.5)
             self.bar.setWindowOpacity(0)
             self.bar.hide()
 
+    def send_result(self, result):
+        """
+        Output stage: encodes the secondary images of a processed image and sends it to the fft_mainWindow, or
+        reports that an image could not be processed.
+        Args:
+            result: (count, processedImage, isLast, runtime, number), or (count, None, isZeroException) on error
+        """
+        count, processedImage = result[:2]
+        if processedImage is None:
+            self.error_sig.emit(self.filenames, count, result[2])
+            return
+        isLast, runtime, number = result[2:]
+        self.sending = processedImage.filename
+        analysis.encode_panels(processedImage, self.directory)
+        self.processedImagesList.append(processedImage)
+        self.sig.emit(count, processedImage, self.processedImagesList, isLast, runtime, number)
+
 
 def main():
     """
-    Enters an event-loop.
+    Enters an event-loop, or runs one of the headless modes if a command was given (see cli).
     """
+    if len(sys.argv) > 1:
+        from src.fiberfit_control import cli
+        cli.main(sys.argv[1:])
+        return
     app = QtWidgets.QApplication(sys.argv)
     fft_app = fft_mainWindow()
     fft_app.receive_dim()
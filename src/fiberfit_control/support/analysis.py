@@ -0,0 +1,247 @@
+"""Per-image analysis step shared by the GUI (fiberfit.MyThread) and the headless modes. Does not depend on Qt."""
+import base64
+import datetime
+import os
+import time
+
+import numpy as np
+
+from src.fiberfit_model import computerVision_BP
+from src.fiberfit_model import mixture as von_mises_mixture
+from src.fiberfit_control.support import img_model
+
+# Secondary png images produced for every image, in the order they are shown on the canvas.
+PANELS = ('orgImg', 'logScl', 'angDist', 'cartDist')
+
+# Columns of the summary table, see report.ReportDialog.exportExcel
+SUMMARY_HEADER = ['Name', 'LowerCut', 'UpperCut', 'RadialStep', 'AngleIncrement', 'Sig', 'Mu', 'K', 'R^2', 'Time',
+                  'K CI Low', 'K CI High', 'Mu CI Low', 'Mu CI High']
+
+# Columns of the per-band table, see analyze_bands_file
+BAND_HEADER = ['Name', 'Band', 'Inner Radius', 'Outer Radius', 'Sig', 'Mu', 'K', 'R^2']
+
+
+def encode_secondary_image(directory, prefix, number):
+    """
+    Encodes one of the secondary png images in base64 for the html report.
+    Args:
+        directory: full path to directory with the secondary images
+        prefix: which image, e.g. 'angDist_'
+        number: number the image was saved under
+    """
+    # Starting from Python3, there is a distinction between bytes and str. Thus, I can't use
+    # methods of str on bytes. However I need to do that in order to properly encode the image
+    # into b64. The main thing is that bytes-way produces some improper characters that mess up
+    # the decoding process. Hence, decode(utf-8) translates bytes into str.
+    with open(panel_path(directory, prefix, number), 'rb') as png:
+        return base64.encodebytes(png.read()).decode('utf-8')
+
+
+def panel_path(directory, prefix, number):
+    """
+    Returns: path of one of the secondary png images.
+    """
+    return directory + "/" + prefix + number.__str__() + '.png'
+
+
+def analyze_file(filename, u_cut, l_cut, angle_inc, rad_step, directory, number, im=None, cache=None, encode=True,
+                 bootstrap=0, timings=None, engine='spline', mixture=0, mode='auto', window=None, precision=None,
+                 memory_cap=None):
+    """
+    Analyzes one image and wraps the result into an img_model.ImgModel.
+    Args:
+        filename: pathlib.Path of the image
+        u_cut: upper cut
+        l_cut: lower cut
+        angle_inc: angle increment
+        rad_step: radial step
+        directory: full path to directory where to put the secondary images in
+        number: number the secondary images are saved under
+        im: the image if it has already been read (see computerVision_BP.read_image)
+        cache: spectrum_cache.SpectrumCache to keep the spectrum in
+        encode: whether to encode the secondary images right away; otherwise see encode_panels
+        bootstrap: number of bootstrap replicates for the confidence intervals of k and th, 0 for none
+        timings: optional dict that receives the durations of the stages (see computerVision_BP.analyze_image, plus
+            'read', 'bootstrap', 'mixture' and 'encode')
+        engine: how to compute the angular distribution, one of computerVision_BP.HISTOGRAM_ENGINES
+        mixture: largest number of components of a von Mises mixture to fit as well (see add_mixtures), 0 for none
+        mode: how the image is brought to a square, FFT-friendly size, 'auto', 'crop' or 'pad' (see
+            preprocessing.conform_image); only used if im is None
+        window: apodization window, None, 'hann' or 'tukey'; only used if im is None
+        precision: floating point type of the spectrum, 'float32', 'float64' or None (see
+            computerVision_BP.spectrum_dtype)
+        memory_cap: largest number of bytes the spectrum may take up, None for no limit
+    Returns:
+        the img_model.ImgModel
+    """
+    start = time.time()
+    if im is None:
+        im = computerVision_BP.read_image(filename, mode, window)
+        start = computerVision_BP.lap(timings, 'read', start)
+    sig, k, th, R2, angDist, cartDist, logScl, orgImg, figWidth, figHeigth, runtime, normPower, theta = \
+        computerVision_BP.analyze_image(im, u_cut, l_cut, angle_inc, rad_step, directory, number, precision,
+                                        memory_cap, cache=cache, key=str(filename), timings=timings, engine=engine)
+    model = img_model.ImgModel(
+        filename=filename,
+        sig=sig,
+        k=k,
+        th=th,
+        R2=R2,
+        orgImg=orgImg,
+        logScl=logScl,
+        angDist=angDist,
+        cartDist=cartDist,
+        timeStamp=datetime.datetime.now().strftime("%A, %d. %B %Y %I:%M%p"),
+        number=number,
+        normPower=normPower,
+        theta=theta)
+    if bootstrap:
+        start = time.time()
+        add_confidence_intervals(model, bootstrap)
+        computerVision_BP.lap(timings, 'bootstrap', start)
+    if mixture:
+        start = time.time()
+        add_mixtures([model], mixture)
+        computerVision_BP.lap(timings, 'mixture', start)
+    if encode:
+        start = time.time()
+        encode_panels(model, directory)
+        computerVision_BP.lap(timings, 'encode', start)
+    return model
+
+
+def analyze_bands_file(filename, u_cut, l_cut, angle_inc, rad_step, bands, im=None, cache=None, mode='auto',
+                       window=None, precision=None, memory_cap=None):
+    """
+    Fits the distribution in several frequency sub-bands of one image (see computerVision_BP.analyze_bands). The
+    spectrum is taken from the cache if it is there, and computed (and cached) otherwise. No figures are made.
+    Args:
+        filename: pathlib.Path of the image
+        u_cut: upper cut
+        l_cut: lower cut
+        angle_inc: angle increment
+        rad_step: radial step
+        bands: number of equally wide sub-bands, or the radii of the band edges
+        im: the image if it has already been read (see computerVision_BP.read_image)
+        cache: spectrum_cache.SpectrumCache to take the spectrum from or keep it in
+        mode, window, precision, memory_cap: how the image is read and transformed, see analyze_file
+    Returns:
+        one row per band (see BAND_HEADER), the band x angle matrix of angular distributions, the angles and the band
+        edges
+    """
+    entry = None if cache is None else cache.get(str(filename))
+    if entry is None:
+        if im is None:
+            im = computerVision_BP.read_image(filename, mode, window)
+        entry = computerVision_BP.power_spectrum(im, precision, memory_cap), im.shape[1]
+        if cache is not None:
+            cache.put(str(filename), *entry)
+    PabsFlip, N1 = entry
+    normPower, theta, edges, results = computerVision_BP.analyze_bands(PabsFlip, N1, u_cut, l_cut, angle_inc,
+                                                                      rad_step, bands)
+    rows = [[filename.stem, band, edges[band], edges[band + 1], round(sig, 2), round(th, 2), round(k, 2),
+             round(R2, 2)] for band, (sig, k, th, R2) in enumerate(results)]
+    return rows, normPower, theta, edges
+
+
+def add_confidence_intervals(model, bootstrap):
+    """
+    Computes the bootstrap confidence intervals of k and th of an img_model.ImgModel from its angular distribution
+    (see computerVision_BP.bootstrap_distribution).
+    Args:
+        model: the img_model.ImgModel
+        bootstrap: number of bootstrap replicates, 0 to leave the intervals out
+    """
+    if bootstrap:
+        model.kCI, model.thCI = computerVision_BP.bootstrap_distribution(model.normPower, model.theta, model.th,
+                                                                         model.k, bootstrap)
+    else:
+        model.kCI, model.thCI = None, None
+
+
+def add_mixtures(models, mixture):
+    """
+    Fits von Mises mixtures to the angular distributions of several img_model.ImgModel at once (see
+    mixture.select_mixture); distributions with the same number of angles are fitted as one batch.
+    Args:
+        models: the img_model.ImgModel
+        mixture: largest number of components, 0 to leave the mixtures out
+    """
+    if not mixture:
+        for model in models:
+            model.components, model.mixtureR2 = None, None
+        return
+    batches = {}
+    for model in models:
+        batches.setdefault(len(model.theta), []).append(model)
+    for batch in batches.values():
+        normPower = np.stack([model.normPower for model in batch])
+        count, weights, th, k, R2 = von_mises_mixture.select_mixture(normPower, batch[0].theta, mixture)
+        for i, model in enumerate(batch):
+            model.components = [(weights[i, c], th[i, c], k[i, c]) for c in range(count[i])]
+            model.mixtureR2 = R2[i]
+
+
+def encode_panels(model, directory):
+    """
+    Fills in the base64 encodings of the secondary images of an img_model.ImgModel.
+    Args:
+        model: the img_model.ImgModel
+        directory: full path to directory with the secondary images
+    """
+    model.orgImgEncoded = encode_secondary_image(directory, 'orgImg_', model.number)
+    model.logSclEncoded = encode_secondary_image(directory, 'logScl_', model.number)
+    model.angDistEncoded = encode_secondary_image(directory, 'angDist_', model.number)
+    model.cartDistEncoded = encode_secondary_image(directory, 'cartDist_', model.number)
+
+
+def to_record(model, u_cut, l_cut, angle_inc, rad_step, directory):
+    """
+    Converts an img_model into a plain, json-serializable result record, as used by the headless modes.
+    Args:
+        model: the img_model.ImgModel
+        u_cut: upper cut
+        l_cut: lower cut
+        angle_inc: angle increment
+        rad_step: radial step
+        directory: full path to directory with the secondary images
+    """
+    return {
+        'name': model.filename.stem,
+        'path': str(model.filename),
+        'number': model.number,
+        'uCut': u_cut,
+        'lCut': l_cut,
+        'angleInc': angle_inc,
+        'radStep': rad_step,
+        'sig': float(model.sig[0]),
+        'mu': float(model.th),
+        'k': float(model.k),
+        'R2': float(model.R2),
+        'timeStamp': model.timeStamp,
+        'kCI': None if model.kCI is None else [float(bound) for bound in model.kCI],
+        'muCI': None if model.thCI is None else [float(bound) for bound in model.thCI],
+        'components': None if model.components is None else [
+            {'weight': float(weight), 'mu': float(th), 'k': float(k)} for weight, th, k in model.components],
+        'mixtureR2': None if model.mixtureR2 is None else float(model.mixtureR2),
+        'panels': {panel: os.path.abspath(panel_path(directory, panel + '_', model.number)) for panel in PANELS},
+    }
+
+
+def summary_row(record):
+    """
+    Returns: row of the summary table (see SUMMARY_HEADER) for a result record.
+    """
+    return [record['name'], record['uCut'], record['lCut'], record['radStep'], record['angleInc'],
+            round(record['sig'], 2), round(record['mu'], 2), round(record['k'], 2), round(record['R2'], 2),
+            record['timeStamp']] + confidence_columns(record.get('kCI'), record.get('muCI'))
+
+
+def confidence_columns(kCI, thCI):
+    """
+    Returns: the confidence interval columns of the summary table, empty if no intervals were computed.
+    """
+    columns = []
+    for interval in (kCI, thCI):
+        columns += ['', ''] if interval is None else [round(bound, 2) for bound in interval]
+    return columns
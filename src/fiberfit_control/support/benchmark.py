@@ -0,0 +1,209 @@
+"""
+Scaling and accuracy benchmark of the analysis on synthetic fiber images (see synthetic).
+
+The benchmark sweeps image sizes x orientation concentrations x noise levels x settings. Every case runs in a fresh
+process, so that its memory figures are not inflated by the cases before it. A case makes its image, analyzes it once
+with tracemalloc on to measure memory, and then `repeats` more times to measure time. For every stage of the analysis
+(see computerVision_BP.analyze_image) it records:
+    <stage> s       fastest wall time of the stage
+    <stage> MB      peak memory allocated during the stage (tracemalloc, which numpy reports its arrays to)
+    <stage> RSS MB  peak resident set size of the process at the end of the stage (not available on Windows)
+along with the k and mu the analysis found, so that accuracy can be plotted against k, noise and size as well. The
+rows are written to a csv file; a previous file can be given as a baseline to report the stages that got slower.
+"""
+import concurrent.futures
+import csv
+import itertools
+import multiprocessing
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+from src.fiberfit_model import computerVision_BP
+from src.fiberfit_model import synthetic
+
+STAGES = ('generate', 'orgImg', 'spectrum', 'histogram', 'distribution', 'logScl')
+CASE_FIELDS = ('Size', 'Mu', 'K', 'Noise', 'UpperCut', 'LowerCut', 'AngleInc', 'RadStep', 'Histogram')
+RESULT_FIELDS = ('Mu Fit', 'Mu Error', 'K Fit', 'R^2', 'Total s')
+HEADER = CASE_FIELDS + RESULT_FIELDS + tuple(
+    '{stage} {unit}'.format(stage=stage, unit=unit) for stage in STAGES for unit in ('s', 'MB', 'RSS MB'))
+
+
+def peak_rss():
+    """
+    Returns:
+        peak resident set size of the process in MB, or None where it is not available
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+class StageProbe(dict):
+    """
+    Stage timings (see computerVision_BP.lap) that also record the memory of every stage when it ends.
+
+    Attributes:
+        traced: peak memory traced by tracemalloc during every stage (MB), while tracemalloc is on
+        rss: peak RSS of the process at the end of every stage (MB)
+    """
+    def __init__(self):
+        super(StageProbe, self).__init__()
+        self.traced = {}
+        self.rss = {}
+
+    def __setitem__(self, stage, seconds):
+        super(StageProbe, self).__setitem__(stage, seconds)
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            self.traced[stage] = max(self.traced.get(stage, 0.0), peak / 2 ** 20)
+            tracemalloc.reset_peak()
+        self.rss[stage] = peak_rss()
+
+
+def run_case(case, repeats=3, seed=0, precision=None):
+    """
+    Runs one case of the benchmark. Meant to run in a process of its own.
+    Args:
+        case: dict with the CASE_FIELDS
+        repeats: number of timed runs, the fastest time of every stage is kept
+        seed: seed of the synthetic image
+        precision: floating point type of the spectrum, see computerVision_BP.spectrum_dtype
+    Returns:
+        csv row (dict with the HEADER fields)
+    """
+    directory = tempfile.mkdtemp(prefix='fiberfit_benchmark_')
+    try:
+        settings = (case['UpperCut'], case['LowerCut'], case['AngleInc'], case['RadStep'])
+        memory = StageProbe()
+        tracemalloc.start()
+        start = time.time()
+        im = synthetic.fiber_image(int(case['Size']), case['Mu'], case['K'], case['Noise'], seed=seed)
+        computerVision_BP.lap(memory, 'generate', start)
+        result = computerVision_BP.analyze_image(im, *settings, directory, 0, precision, timings=memory,
+                                                 engine=case['Histogram'])
+        tracemalloc.stop()
+
+        fastest = {'generate': memory['generate']}
+        for i in range(repeats):
+            timings = {}
+            start = time.time()
+            result = computerVision_BP.analyze_image(im, *settings, directory, 0, precision, timings=timings,
+                                                     engine=case['Histogram'])
+            timings['total'] = time.time() - start
+            for stage, seconds in timings.items():
+                fastest[stage] = min(fastest.get(stage, seconds), seconds)
+
+        sig, k, th, R2 = result[:4]
+        row = dict(case)
+        row.update({'Mu Fit': th, 'Mu Error': (th - case['Mu'] + 90) % 180 - 90, 'K Fit': k, 'R^2': R2,
+                    'Total s': fastest.get('total')})
+        for stage in STAGES:
+            row[stage + ' s'] = fastest.get(stage)
+            row[stage + ' MB'] = memory.traced.get(stage)
+            row[stage + ' RSS MB'] = memory.rss.get(stage)
+        return row
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def build_cases(sizes, ks, noises, u_cuts, l_cuts, angle_incs, rad_steps, engines=('spline',), mu=90.0):
+    """
+    Returns:
+        all combinations of the given values, as dicts with the CASE_FIELDS
+    """
+    return [dict(zip(CASE_FIELDS, (size, mu, k, noise, u_cut, l_cut, angle_inc, rad_step, engine)))
+            for size, k, noise, u_cut, l_cut, angle_inc, rad_step, engine
+            in itertools.product(sizes, ks, noises, u_cuts, l_cuts, angle_incs, rad_steps, engines)]
+
+
+def run_benchmark(cases, output, repeats=3, seed=0, precision=None, progress=print):
+    """
+    Runs the cases one after the other, each in a fresh process, and writes the rows to a csv file as they finish.
+    Args:
+        cases: see build_cases
+        output: path of the csv file
+        progress: called with a line of text after every case
+    Returns:
+        the rows
+    """
+    rows = []
+    context = multiprocessing.get_context('spawn')
+    with open(output, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, HEADER)
+        writer.writeheader()
+        for case in cases:
+            with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+                row = pool.submit(run_case, case, repeats, seed, precision).result()
+            writer.writerow(row)
+            csvfile.flush()
+            rows.append(row)
+            progress("{size}px k={k} noise={noise}: {total:.3f} s, mu {mu:.1f}, k {kFit:.2f}".format(
+                size=case['Size'], k=case['K'], noise=case['Noise'], total=row['Total s'], mu=row['Mu Fit'],
+                kFit=row['K Fit']))
+    return rows
+
+
+def read_rows(path):
+    """
+    Returns:
+        the rows of a csv file written by run_benchmark, with numbers converted to float
+    """
+    def convert(value):
+        if value in ('', None):
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+    rows = []
+    with open(path, newline='') as csvfile:
+        for row in csv.DictReader(csvfile):
+            rows.append({field: convert(value) for field, value in row.items()})
+    return rows
+
+
+def find_regressions(rows, baseline, tolerance=0.25, min_seconds=0.01):
+    """
+    Compares the stage timings of two benchmark runs case by case.
+    Args:
+        rows: rows of the new run
+        baseline: rows of the earlier run, see read_rows
+        tolerance: relative slowdown that is tolerated
+        min_seconds: absolute slowdown that is tolerated, so that tiny stages do not report noise
+    Returns:
+        one line of text per stage that got slower
+    """
+    def key(row):
+        # runs from before the histogram engines were added used the spline
+        return tuple(str(row.get(field, 'spline')) if field == 'Histogram' else float(row[field])
+                     for field in CASE_FIELDS)
+
+    earlier = {key(row): row for row in baseline}
+    regressions = []
+    for row in rows:
+        before = earlier.get(key(row))
+        if before is None:
+            continue
+        for stage in STAGES + ('Total',):
+            field = stage + ' s'
+            old, new = before.get(field), row.get(field)
+            if old is None or new is None:
+                continue
+            if new > old * (1 + tolerance) and new - old > min_seconds:
+                regressions.append("{case}: {stage} took {new:.3f} s instead of {old:.3f} s".format(
+                    case=", ".join("{field}={value}".format(field=field, value=value)
+                                   for field, value in zip(CASE_FIELDS, key(row))),
+                    stage=stage, new=new, old=old))
+    return regressions
@@ -0,0 +1,126 @@
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, Qt
+
+
+class ImageCollection:
+    """
+    The processed images of a session, in the order they were first processed. An image is found by its position or
+    by its file name (see img_model.ImgModel._key) in constant time; processing an image again replaces it in place.
+    """
+    def __init__(self):
+        self._images = []
+        self._rows = {}
+
+    def add(self, image):
+        """
+        Adds an image, or replaces the image with the same file name.
+        Args:
+            image: img_model.ImgModel
+        Returns:
+            (row of the image, whether it is new)
+        """
+        row = self._rows.get(image._key())
+        if row is not None:
+            self._images[row] = image
+            return row, False
+        self._rows[image._key()] = len(self._images)
+        self._images.append(image)
+        return len(self._images) - 1, True
+
+    def index(self, image):
+        """
+        Returns: row of the image with the same file name; raises ValueError if there is none, like list.index
+        """
+        try:
+            return self._rows[image._key()]
+        except KeyError:
+            raise ValueError("{name} is not in the collection".format(name=image.filename))
+
+    def clear(self):
+        self._images.clear()
+        self._rows.clear()
+
+    def __getitem__(self, row):
+        return self._images[row]
+
+    def __len__(self):
+        return len(self._images)
+
+    def __iter__(self):
+        return iter(self._images)
+
+    def __contains__(self, image):
+        return image._key() in self._rows
+
+
+class ImageListModel(QAbstractListModel):
+    """
+    Item model of an ImageCollection for the image selection box: one row per image, showing its name.
+
+    New images are announced to the views one row insert at a time, instead of the views being refilled. Rows are
+    handed to the views lazily, FETCH_SIZE at a time as they scroll (see canFetchMore), so the cost of a view does not
+    grow with the size of the session.
+
+    Attributes:
+        images: the ImageCollection
+        loaded: number of rows the views know of
+    """
+    FETCH_SIZE = 256
+
+    def __init__(self, images, parent=None):
+        super(ImageListModel, self).__init__(parent)
+        self.images = images
+        self.loaded = len(images)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.loaded
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self.loaded:
+            return None
+        if role == Qt.DisplayRole:
+            return self.images[index.row()].filename.stem
+        if role == Qt.ToolTipRole:
+            return str(self.images[index.row()].filename)
+        return None
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.loaded < len(self.images)
+
+    def fetchMore(self, parent):
+        count = min(self.FETCH_SIZE, len(self.images) - self.loaded)
+        if parent.isValid() or count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self.loaded, self.loaded + count - 1)
+        self.loaded += count
+        self.endInsertRows()
+
+    def add(self, image):
+        """
+        Adds an image to the collection and notifies the views.
+        Args:
+            image: img_model.ImgModel
+        Returns:
+            row of the image
+        """
+        row, isNew = self.images.add(image)
+        if isNew and row == self.loaded:
+            # the views are up to date, so they get the new row right away; otherwise it comes with fetchMore
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.loaded += 1
+            self.endInsertRows()
+        elif not isNew and row < self.loaded:
+            self.dataChanged.emit(self.index(row), self.index(row))
+        return row
+
+    def ensure_loaded(self, row):
+        """
+        Makes sure the views know of the row, e.g. before selecting it.
+        """
+        while row >= self.loaded and self.canFetchMore(QModelIndex()):
+            self.fetchMore(QModelIndex())
+
+    def clear(self):
+        self.beginResetModel()
+        self.images.clear()
+        self.loaded = 0
+        self.endResetModel()
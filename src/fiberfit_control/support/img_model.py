@@ -9,7 +9,8 @@ class ImgModel:
 
     def __init__(self, filename,sig = None, k=None, th=None, R2=None, orgImg=None, orgImgEncoded=None, logScl=None,
                  logSclEncoded=None,  angDist=None, angDistEncoded=None, cartDist=None,
-                 cartDistEncoded=None, timeStamp=None, number = None):
+                 cartDistEncoded=None, timeStamp=None, number = None, normPower=None, theta=None,
+                 kCI=None, thCI=None, components=None, mixtureR2=None):
         self.filename = filename
         self.sig = sig,
         self.th = th
@@ -25,6 +26,15 @@ class ImgModel:
         self.cartDistEncoded = cartDistEncoded
         self.timeStamp = timeStamp
         self.number = number
+        # angular distribution: normalized power at the angles theta (radians)
+        self.normPower = normPower
+        self.theta = theta
+        # bootstrap confidence intervals (low, high) of k and th, if they were computed
+        self.kCI = kCI
+        self.thCI = thCI
+        # von Mises mixture fitted to the angular distribution, if it was: a (weight, th, k) tuple per component
+        self.components = components
+        self.mixtureR2 = mixtureR2
 
     def _key(self):
         return self.filename
@@ -0,0 +1,100 @@
+"""
+Building blocks for overlapping the stages of processing a batch of images.
+
+Reading an image (especially from a network share) does not need the CPU, and encoding and handing over a result
+does not need to hold up the next image. read_ahead decodes the next images in a background thread while the
+current one is analyzed, and OutputStage finishes the results in another one. Both hand items over through bounded
+queues, so at most `depth` images wait in each stage and memory stays capped.
+"""
+import queue
+import threading
+
+# marks the end of a stream of items
+_DONE = object()
+
+
+def read_ahead(items, read, depth=2):
+    """
+    Reads items in a background thread, at most depth items ahead of the consumer.
+    Args:
+        items: e.g. the file names
+        read: function reading one item, e.g. computerVision_BP.read_image
+        depth: number of read items that may wait for the consumer
+    Returns:
+        generator of (item, result, error) in the order of items; error is the exception raised by read, or None
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(entry):
+        # gives up when the consumer has gone away, so that the thread never blocks forever
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        for item in items:
+            try:
+                entry = (item, read(item), None)
+            except Exception as e:
+                entry = (item, None, e)
+            if not put(entry):
+                return
+        put(_DONE)
+
+    reader = threading.Thread(target=produce, daemon=True)
+    reader.start()
+    try:
+        while True:
+            entry = buffer.get()
+            if entry is _DONE:
+                return
+            yield entry
+    finally:
+        stop.set()
+        reader.join()
+
+
+class OutputStage:
+    """
+    Runs consume on the submitted items, in order, in a background thread.
+
+    Attributes:
+        consume: function finishing one item, e.g. encoding and sending a result
+        depth: number of items that may wait; submit blocks while the stage is full
+    """
+    def __init__(self, consume, depth=2):
+        self.consume = consume
+        self.error = None
+        self._buffer = queue.Queue(maxsize=depth)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        self._buffer.put(item)
+
+    def close(self):
+        """
+        Waits until all submitted items are finished. Re-raises the first exception raised by consume.
+        """
+        self._buffer.put(_DONE)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        while True:
+            item = self._buffer.get()
+            if item is _DONE:
+                return
+            if self.error is not None:
+                # keep draining so that submit does not block
+                continue
+            try:
+                self.consume(item)
+            except Exception as e:
+                self.error = e
@@ -0,0 +1,127 @@
+"""
+Preflight check of a selection of images, from their headers only, before any of them is decoded or transformed.
+
+Opening an image with PIL only reads its header (size, mode, number of frames); the pixels are decoded on first
+access, which the check never makes. Files that the analysis can not process are rejected up front, with the reason,
+so that a batch is not interrupted by them and they can be reported together:
+    unreadable      not an image PIL can open
+    color           more than one channel (color or alpha); FiberFit analyzes 8-bit grayscale images
+    palette         indexed color, whose values are palette indices rather than intensities
+    too small       the image, brought to a square, is too small for the lower cutoff
+Files that are processed in a particular way are accepted with a note:
+    multi-frame     only the first frame is analyzed (the sequence command analyzes all of them)
+"""
+import concurrent.futures
+
+from PIL import Image
+
+from src.fiberfit_model import preprocessing
+
+# bit depth of a channel of the single-channel PIL modes that can be analyzed
+GRAY_DEPTHS = {'1': 1, 'L': 8, 'I;16': 16, 'I;16B': 16, 'I;16L': 16, 'I': 32, 'F': 32}
+
+
+class ImageHeader:
+    """
+    What the header of an image tells.
+
+    Attributes:
+        path: the file
+        format: file format, e.g. 'PNG'
+        mode: PIL mode, e.g. 'L'
+        size: (width, height)
+        frames: number of frames (pages)
+        error: why the file could not be opened, or None
+    """
+    def __init__(self, path, format=None, mode=None, size=None, frames=1, error=None):
+        self.path = path
+        self.format = format
+        self.mode = mode
+        self.size = size
+        self.frames = frames
+        self.error = error
+
+    @property
+    def channels(self):
+        return Image.getmodebands(self.mode) if self.mode else None
+
+    @property
+    def depth(self):
+        return GRAY_DEPTHS.get(self.mode)
+
+
+def read_header(path):
+    """
+    Returns: ImageHeader of a file, without decoding its pixels
+    """
+    try:
+        with Image.open(str(path)) as image:
+            return ImageHeader(path, image.format, image.mode, image.size, getattr(image, 'n_frames', 1))
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        return ImageHeader(path, error=e)
+
+
+def check_header(header, l_cut=None):
+    """
+    Args:
+        header: ImageHeader
+        l_cut: lower cutoff of the analysis, to check that the image is large enough; None not to check
+    Returns:
+        (rejection, note): why the image can not be processed, or None; and how it will be processed, or None
+    """
+    if header.error is not None:
+        return "unreadable ({error})".format(error=header.error), None
+    if header.mode == 'P':
+        return "palette image; convert it to 8-bit grayscale", None
+    if header.channels != 1 or header.depth is None:
+        return "{mode} image with {channels} channels; convert it to 8-bit grayscale".format(
+            mode=header.mode, channels=header.channels), None
+    side = preprocessing.conformed_side(header.size)
+    if l_cut is not None and side // 2 - 1 <= l_cut:
+        return "{width} x {height} is too small for the lower cutoff {l_cut}".format(
+            width=header.size[0], height=header.size[1], l_cut=l_cut), None
+    if header.frames > 1:
+        return None, "{frames} frames, only the first one is analyzed".format(frames=header.frames)
+    return None, None
+
+
+def check_files(paths, l_cut=None, workers=8):
+    """
+    Checks the headers of a whole selection at once. The headers are read on a few threads, as reading them mostly
+    waits for the disk (or network share).
+    Args:
+        paths: the selected files
+        l_cut: see check_header
+        workers: number of threads reading headers
+    Returns:
+        (accepted, rejected, notes): the paths that can be processed, in order; (path, reason) of the others; and
+        (path, note) of accepted paths that are processed in a particular way
+    """
+    paths = list(paths)
+    with concurrent.futures.ThreadPoolExecutor(max(1, min(workers, len(paths)))) as pool:
+        headers = list(pool.map(read_header, paths))
+    accepted, rejected, notes = [], [], []
+    for header in headers:
+        rejection, note = check_header(header, l_cut)
+        if rejection is not None:
+            rejected.append((header.path, rejection))
+            continue
+        accepted.append(header.path)
+        if note is not None:
+            notes.append((header.path, note))
+    return accepted, rejected, notes
+
+
+def summary(rejected, notes):
+    """
+    Returns: text listing the rejected files and the notes, for one dialog or log message; empty if there are none
+    """
+    lines = []
+    if rejected:
+        lines.append("{count} file(s) can not be processed and were skipped:".format(count=len(rejected)))
+        lines += ["    {name}: {reason}".format(name=getattr(path, 'name', path), reason=reason)
+                  for path, reason in rejected]
+    if notes:
+        lines.append("Note:")
+        lines += ["    {name}: {note}".format(name=getattr(path, 'name', path), note=note) for path, note in notes]
+    return "\n".join(lines)
@@ -2,6 +2,8 @@ import sys
 sys.path.append("/fiberfit/")
 from src.fiberfit_gui import export_window
 from src.fiberfit_control.support import img_model
+from src.fiberfit_control.support import analysis
+from src.fiberfit_control.support import result_bus
 
 from PyQt5.QtWidgets import QDialogButtonBox, QDialog, QFileDialog
 from PyQt5.QtGui import QTextDocument
@@ -13,10 +15,6 @@ import csv
 import pathlib
 import os
 
-class OrderedSet(set):
-    def __init__(self):
-        super(OrderedSet, self).__init__()
-
 class ReportDialog(QDialog, export_window.Ui_Dialog):
     """ Summary of ReportDialog.
 
@@ -40,21 +38,17 @@ class ReportDialog(QDialog, export_window.Ui_Dialog):
 
         super(ReportDialog, self).__init__(parent)
         self.fft_mainWindow=fft_mainWindow
-        self.dataList = []
+        # rows of the summary table, shared with the main window, which empties it when it is cleared
+        self.dataList = fft_mainWindow.data_list
         self.setupUi(self, screenDim)
         self.screenDim = screenDim
         self.document = QTextDocument()
-        #list that keeps track of only selected images
-        self.list = []
+        # results published by the main window (see receive_result)
+        self.results = result_bus.ResultView()
         #list that contains all of the stored images
-        self.wholeList = OrderedSet()
+        self.wholeList = self.results.images
         self.savedfiles = None
         self.currentModel = None
-        # settings
-        self.uCut = 0
-        self.lCut = 0
-        self.angleInc = 0
-        self.radStep = 0
         #  states
         """
         0 -> single
@@ -130,15 +124,13 @@ class ReportDialog(QDialog, export_window.Ui_Dialog):
         if self.dataList.__len__() == 0:
             self.dataList.append(
                 [self.wholeList[0].filename.stem,
-                 self.uCut,
-                 self.lCut,
-                 self.radStep,
-                 self.angleInc,
+                 *self.results.settings_of(self.wholeList[0]),
                  self.wholeList[0].sig,
                  self.wholeList[0].th,
                  self.wholeList[0].k,
                  self.wholeList[0].R2,
-                 self.wholeList[0].timeStamp])
+                 self.wholeList[0].timeStamp] +
+                analysis.confidence_columns(self.wholeList[0].kCI, self.wholeList[0].thCI))
         temp = []
         for i in range(0, self.wholeList.__len__()):
             temp.append(self.wholeList[i])
@@ -149,31 +141,27 @@ class ReportDialog(QDialog, export_window.Ui_Dialog):
                 if found is False and self.dataList[i][0] == temp[j].filename.stem:
                     self.dataList.remove(self.dataList[i])
                     self.dataList.insert(i, [temp[j].filename.stem,
-                                             self.uCut,
-                                             self.lCut,
-                                             self.radStep,
-                                             self.angleInc,
+                                             *self.results.settings_of(temp[j]),
                                              round(temp[j].sig[0], 2),
                                              round(temp[j].th, 2),
                                              round(temp[j].k, 2),
                                              round(temp[j].R2, 2),
-                                             temp[j].timeStamp])
+                                             temp[j].timeStamp] +
+                                            analysis.confidence_columns(temp[j].kCI, temp[j].thCI))
                     temp.remove(temp[j])
                     found = True
         for k in range(0, len(temp)):
             self.dataList.append([temp[k].filename.stem,
-                                  self.uCut,
-                                  self.lCut,
-                                  self.radStep,
-                                  self.angleInc,
+                                  *self.results.settings_of(temp[k]),
                                   round(temp[k].sig[0], 2),
                                   round(temp[k].th, 2),
                                   round(temp[k].k, 2),
                                   round(temp[k].R2, 2),
-                                  temp[k].timeStamp])
+                                  temp[k].timeStamp] +
+                                 analysis.confidence_columns(temp[k].kCI, temp[k].thCI))
         with open(str(self.savedfiles.parents[0]) + '/summary.csv', 'w') as csvfile:
             a = csv.writer(csvfile)
-            a.writerow(['Name', 'LowerCut', 'UpperCut', 'RadialStep', 'AngleIncrement', 'Sig', 'Mu', 'K', 'R^2', 'Time'])
+            a.writerow(analysis.SUMMARY_HEADER)
             a.writerows(self.dataList)
         self.fft_mainWindow.dataList = self.dataList
 
@@ -292,16 +280,10 @@ class ReportDialog(QDialog, export_window.Ui_Dialog):
         self.currentModel = model
         self.show()
 
-    @pyqtSlot(list, list, OrderedSet, float, float, float, float)
-    def receiver(self, selectedImgs, dataList, imgList, uCut, lCut, radStep, angleInc):
+    def receive_result(self, event):
         """
-        Received an information from FiberFit applicatin with necessary report data.
+        Takes over a new or changed result, or the removal of all results, from the main window's result_bus. The
+        settings of every result are kept with it (see result_bus.ResultView.settings_of).
         """
-        self.dataList = dataList
-        self.list = selectedImgs
-        self.wholeList = imgList
-        self.uCut = uCut
-        self.lCut = lCut
-        self.radStep = radStep
-        self.angleInc = angleInc
+        self.results.apply(event)
 
@@ -0,0 +1,163 @@
+"""
+Headless version of the report of report.ReportDialog, for batch runs on machines without Qt or a display.
+
+Reports are built from result records (see analysis.to_record, e.g. the results.jsonl written by
+work_queue.merge_shards). A record becomes one page with the same summary as the dialog's report: name, mu, k, R^2,
+sigma, the four panels and the time stamp. The pages are rendered in parallel worker processes and merged into one
+PDF. Alternatively, the report is written as a static HTML bundle (index.html plus the panel images).
+"""
+import concurrent.futures
+import html
+import os
+import shutil
+import tempfile
+
+import matplotlib.image
+from matplotlib.backends.backend_pdf import FigureCanvasPdf
+from matplotlib.figure import Figure
+from PyPDF2 import PdfFileMerger as merger
+
+from src.fiberfit_model import renderer
+from src.fiberfit_control.support import analysis
+
+# US letter, in inches
+PAGE_SIZE = (8.5, 11)
+
+HTML_PAGE = """
+        <html>
+            <head>
+                <meta charset="utf-8"/>
+                <title>FiberFit Report</title>
+                <style>
+                    .image {{ page-break-after: always; }}
+                </style>
+            </head>
+            <body>
+                {pages}
+            </body>
+        </html>
+        """
+
+HTML_IMAGE = """
+                <div class="image" id="{number}">
+                    {lines}
+                    <br>
+                    <table>
+                        <tr>
+                            <td> <img src = "{orgImg}" width = "250", height = "250" /></td>
+                            <td> <img src = "{logScl}" width = "250", height = "250" /></td>
+                        </tr>
+                        <tr>
+                            <td> <img src = "{angDist}" width = "250", height = "250" /></td>
+                            <td> <img src = "{cartDist}" width = "250", height = "250" /></td>
+                        </tr>
+                    </table>
+                    <p><br><br>
+                        {date}
+                    </p>
+                </div>
+"""
+
+
+def summary_lines(record):
+    """
+    Returns: the summary lines of an image's page, as in report.ReportDialog.createHtml
+    """
+    lines = ["Image Name: {name}".format(name=record['name']),
+             "μ: {th}°".format(th=round(record['mu'], 2)),
+             "k: {k}".format(k=round(record['k'], 2)),
+             "R^2: {R2}".format(R2=round(record['R2'], 2)),
+             "σ: {sig}°".format(sig=round(record['sig'], 2))]
+    if record.get('kCI') is not None:
+        lines.append("k CI: {low} - {high}".format(low=round(record['kCI'][0], 2), high=round(record['kCI'][1], 2)))
+    if record.get('muCI') is not None:
+        lines.append("μ CI: {low}° - {high}°".format(low=round(record['muCI'][0], 2),
+                                                     high=round(record['muCI'][1], 2)))
+    for number, component in enumerate(record.get('components') or [], 1):
+        lines.append("Component {number}: μ {th}°, k {k}, weight {weight}".format(
+            number=number, th=round(component['mu'], 2), k=round(component['k'], 2),
+            weight=round(component['weight'], 2)))
+    if record.get('mixtureR2') is not None:
+        lines.append("Mixture R^2: {R2}".format(R2=round(record['mixtureR2'], 2)))
+    return lines
+
+
+def render_page(record, path):
+    """
+    Renders the page of one image into a single-page PDF. Runs in a worker process.
+    Args:
+        record: result record, see analysis.to_record
+        path: where to write the PDF
+    """
+    figure = Figure(figsize=PAGE_SIZE)
+    FigureCanvasPdf(figure)
+    font = renderer.resolve_font(size=12)
+    top = 0.94
+    for line in summary_lines(record):
+        figure.text(0.1, top, line, fontproperties=font)
+        top -= 0.03
+
+    # 2 x 2 grid of square panels, 2.5 in wide
+    width, height = 2.5 / PAGE_SIZE[0], 2.5 / PAGE_SIZE[1]
+    bottom = top - 0.02 - 2 * height
+    corners = [(0.1, bottom + height), (0.1 + width, bottom + height), (0.1, bottom), (0.1 + width, bottom)]
+    for panel, (left, lower) in zip(analysis.PANELS, corners):
+        ax = figure.add_axes([left, lower, width, height])
+        ax.set_axis_off()
+        pixels = matplotlib.image.imread(record['panels'][panel])
+        if pixels.ndim == 2:
+            ax.imshow(pixels, cmap='gray', vmin=0, vmax=1, aspect='auto')
+        else:
+            ax.imshow(pixels, aspect='auto')
+    figure.text(0.1, bottom - 0.06, record['timeStamp'], fontproperties=font)
+    figure.savefig(path)
+
+
+def write_pdf(records, path, workers=None):
+    """
+    Writes the report of all records into one PDF, one page per image.
+    Args:
+        records: result records, see analysis.to_record
+        path: where to write the PDF
+        workers: number of processes rendering pages, defaults to the number of CPUs
+    """
+    directory = tempfile.mkdtemp(prefix='fiberfit_report_')
+    try:
+        pages = [os.path.join(directory, '{i}.pdf'.format(i=i)) for i in range(len(records))]
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            # list() re-raises the first failure
+            list(pool.map(render_page, records, pages))
+        pdf = merger()
+        for page in pages:
+            pdf.append(page)
+        with open(path, 'wb') as out:
+            pdf.write(out)
+        pdf.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def write_html(records, directory):
+    """
+    Writes the report of all records as a static HTML bundle: directory/index.html and the panels it refers to in
+    directory/panels.
+    Args:
+        records: result records, see analysis.to_record
+        directory: where to write the bundle
+    """
+    os.makedirs(os.path.join(directory, 'panels'), exist_ok=True)
+    pages = []
+    for record in records:
+        sources = {}
+        for panel in analysis.PANELS:
+            name = 'panels/{panel}_{number}.png'.format(panel=panel, number=record['number'])
+            shutil.copyfile(record['panels'][panel], os.path.join(directory, name))
+            sources[panel] = name
+        pages.append(HTML_IMAGE.format(
+            number=record['number'],
+            lines="\n                    ".join("<p>{line}</p>".format(line=html.escape(line))
+                                                for line in summary_lines(record)),
+            date=html.escape(record['timeStamp']),
+            **sources))
+    with open(os.path.join(directory, 'index.html'), 'w', encoding='utf-8') as index:
+        index.write(HTML_PAGE.format(pages="".join(pages)))
@@ -0,0 +1,135 @@
+"""
+Incremental hand-over of results from the main window to the parts that show or export them (e.g. the report).
+
+Instead of the whole collection being sent after every image, the bus publishes one event per new or changed result.
+Every event carries a sequence number, one higher than that of the event before, so that a subscriber can tell
+whether it has seen an event already. A subscriber that comes in late gets a single snapshot of all results instead,
+numbered like the last event. A subscriber keeps its own indexed view of the results (see ResultView), so the cost of
+an event does not depend on the number of images in the session.
+"""
+import threading
+
+from src.fiberfit_control.support import image_list
+
+RESULT = 'result'
+RESET = 'reset'
+SNAPSHOT = 'snapshot'
+
+
+class ResultEvent:
+    """
+    Attributes:
+        sequence: number of the event, starting from 1; a SNAPSHOT has the number of the last event it includes
+        kind: RESULT for a new or changed result, RESET when all results were removed, SNAPSHOT for all results at
+            once
+        image: the img_model.ImgModel of a RESULT event
+        settings: (u_cut, l_cut, rad_step, angle_inc) the result was computed with
+        results: (image, settings) of every result, for a SNAPSHOT
+    """
+    def __init__(self, sequence, kind, image=None, settings=None, results=()):
+        self.sequence = sequence
+        self.kind = kind
+        self.image = image
+        self.settings = settings
+        self.results = results
+
+
+class ResultBus:
+    """
+    Publishes the results of a session to its subscribers, in order. Thread-safe.
+
+    Attributes:
+        images: the collection the results are published from (e.g. fft_mainWindow.imgList), used to bring new
+            subscribers up to date
+        sequence: number of the last event
+        settings: settings of every published result, by img_model.ImgModel._key
+    """
+    def __init__(self, images=None):
+        self.images = images
+        self.sequence = 0
+        self.settings = {}
+        self._subscribers = []
+        self._lock = threading.RLock()
+
+    def subscribe(self, callback):
+        """
+        Args:
+            callback: called with every ResultEvent. A subscriber that comes in late first gets a snapshot of the
+                results that are already in images.
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+            if self.images is not None and self.sequence > 0:
+                results = tuple((image, self.settings.get(image._key())) for image in self.images)
+                callback(ResultEvent(self.sequence, SNAPSHOT, results=results))
+
+    def publish(self, image, settings):
+        """
+        Publishes a new or changed result.
+        Args:
+            image: the img_model.ImgModel
+            settings: (u_cut, l_cut, rad_step, angle_inc)
+        """
+        with self._lock:
+            self.settings[image._key()] = settings
+            self._send(RESULT, image, settings)
+
+    def reset(self):
+        """
+        Tells the subscribers that all results were removed.
+        """
+        with self._lock:
+            self.settings.clear()
+            self._send(RESET)
+
+    def _send(self, kind, image=None, settings=None):
+        self.sequence += 1
+        event = ResultEvent(self.sequence, kind, image, settings)
+        for callback in self._subscribers:
+            callback(event)
+
+
+class ResultView:
+    """
+    A subscriber's indexed copy of the results.
+
+    Attributes:
+        images: image_list.ImageCollection of the results
+        settings: settings of every result, by img_model.ImgModel._key
+        sequence: number of the last event applied
+    """
+    def __init__(self):
+        self.images = image_list.ImageCollection()
+        self.settings = {}
+        self.sequence = 0
+
+    def apply(self, event):
+        """
+        Applies an event. Events that were applied already, or that are older than the view, are ignored.
+        Args:
+            event: ResultEvent
+        Returns:
+            whether the view changed
+        """
+        if event.sequence <= self.sequence:
+            return False
+        if event.kind == RESULT:
+            self.add(event.image, event.settings)
+        else:
+            # a reset or a snapshot starts over, so the events before it do not matter
+            self.images.clear()
+            self.settings.clear()
+            for image, settings in event.results:
+                self.add(image, settings)
+        self.sequence = event.sequence
+        return True
+
+    def add(self, image, settings):
+        self.images.add(image)
+        self.settings[image._key()] = settings
+
+    def settings_of(self, image):
+        """
+        Returns: (u_cut, l_cut, rad_step, angle_inc) the result of an image was computed with
+        """
+        return self.settings[image._key()]
@@ -0,0 +1,416 @@
+"""
+Local HTTP analysis service, so that other programs (e.g. a LIMS) can call FiberFit like any other service.
+
+An asyncio front end parses the requests and decodes the images (on a thread), and hands them to a pool of worker
+processes through shared memory (see shared_arrays), which run the computerVision_BP pipeline. The angular
+distributions come back through shared memory as well. Only the standard library is used for the HTTP part, and the
+server binds to localhost by default.
+
+Endpoints:
+    POST /analyze   JSON body {"path": "/local/image.png", "uCut": 2, "lCut": 32, "angleInc": 1, "radStep": 0.5,
+                    "distributions": false, "images": false, "bootstrap": 0, "histogram": "spline",
+                    "mixture": 0}, or the raw image
+                    bytes as body with the same fields in the query string (POST /analyze?lCut=24&images=1). Settings
+                    that are left out get the defaults of settings.SettingsWindow. A "path" is only accepted if the
+                    service was given an image_root, and has to lie inside of it (relative paths are taken relative
+                    to it); otherwise the request is rejected with 403.
+    GET /health     liveness and current load
+    GET /metrics    request counters and latencies
+
+At most max_concurrency images are analyzed at the same time; up to max_pending further requests wait for a slot and
+any beyond that are rejected with 503. A request that takes longer than timeout seconds is answered with 504. Note
+that its worker process still finishes the image, as a running process pool job can not be cancelled, and keeps its
+slot until then.
+"""
+import asyncio
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import time
+import urllib.parse
+
+from src.fiberfit_model import computerVision_BP
+from src.fiberfit_control.support import analysis
+from src.fiberfit_control.support import shared_arrays
+from src.fiberfit_control.support import telemetry
+
+DEFAULT_SETTINGS = {'uCut': 2.0, 'lCut': 32.0, 'angleInc': 1.0, 'radStep': 0.5}
+
+REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def run_analysis(im, path, settings, directory, images=False, bootstrap=0, engine='spline', mixture=0, precision=None,
+                 memory_cap=None, out=None):
+    """
+    Analyzes one image. Runs inside a worker process of a shared_arrays.SharedAnalysisPool, so everything else passed
+    in and out has to be picklable.
+    Args:
+        im: the decoded image (see computerVision_BP.read_image), in shared memory
+        path: path of the image
+        settings: dict with uCut, lCut, angleInc and radStep
+        directory: empty scratch directory for the secondary images; it is removed afterwards
+        images: whether to include the secondary png images (base64)
+        bootstrap: number of bootstrap replicates for the confidence intervals of k and mu, 0 for none
+        engine: how to compute the angular distribution, one of computerVision_BP.HISTOGRAM_ENGINES
+        mixture: largest number of components of the von Mises mixture, 0 for none (see analysis.add_mixtures)
+        precision: floating point type of the spectrum, see computerVision_BP.spectrum_dtype
+        memory_cap: largest number of bytes the spectrum may take up, None for no limit
+        out: (2, computerVision_BP.angle_count) array in shared memory that receives the angular distribution
+            (normPower, theta), None if it is not asked for
+    Returns:
+        result record, see analysis.to_record
+    """
+    try:
+        timings = {}
+        model = analysis.analyze_file(pathlib.Path(path), settings['uCut'], settings['lCut'], settings['angleInc'],
+                                      settings['radStep'], directory, 0, im=im, bootstrap=bootstrap, timings=timings,
+                                      engine=engine, mixture=mixture, precision=precision, memory_cap=memory_cap)
+        record = analysis.to_record(model, settings['uCut'], settings['lCut'], settings['angleInc'],
+                                    settings['radStep'], directory)
+        # the scratch directory does not outlive the request
+        del record['panels']
+        record['stages'] = timings
+        if out is not None:
+            out[0] = model.normPower
+            out[1] = model.theta
+        if images:
+            record['images'] = {panel: analysis.encode_secondary_image(directory, panel + '_', 0)
+                                for panel in analysis.PANELS}
+        return record
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def parse_settings(fields):
+    """
+    Returns: (settings, distributions, images, bootstrap, engine, mixture) from the request fields, with the defaults
+        filled in
+    """
+    settings = {}
+    for name, default in DEFAULT_SETTINGS.items():
+        try:
+            settings[name] = float(fields.get(name, default))
+        except (TypeError, ValueError):
+            raise HTTPError(400, "{name} must be a number".format(name=name))
+    try:
+        bootstrap = int(fields.get('bootstrap', 0))
+    except (TypeError, ValueError):
+        raise HTTPError(400, "bootstrap must be an integer")
+    try:
+        mixture = int(fields.get('mixture', 0))
+    except (TypeError, ValueError):
+        raise HTTPError(400, "mixture must be an integer")
+    engine = fields.get('histogram', 'spline')
+    if engine not in computerVision_BP.HISTOGRAM_ENGINES:
+        raise HTTPError(400, "histogram must be one of {engines}".format(
+            engines=", ".join(sorted(computerVision_BP.HISTOGRAM_ENGINES))))
+    return settings, as_flag(fields.get('distributions')), as_flag(fields.get('images')), bootstrap, engine, mixture
+
+
+def as_flag(value):
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+class AnalysisService:
+    """
+    Attributes:
+        host, port: address to listen on
+        max_concurrency: number of worker processes, i.e. images analyzed at the same time
+        max_pending: number of requests that may wait for a worker before new ones are rejected
+        timeout: seconds a request may take
+        max_body: largest accepted request body (bytes)
+        work_dir: where uploads and secondary images are kept while a request is processed
+        image_root: directory the images named by "path" in a request must be in, None to only accept uploads
+        events: telemetry.EventStream the requests are reported to
+        mode, window: how the images are brought to a square, FFT-friendly size (see computerVision_BP.read_image)
+        precision, memory_cap: floating point type of the spectra and the largest number of bytes a spectrum may
+            take up (see computerVision_BP.spectrum_dtype)
+    """
+    def __init__(self, host='127.0.0.1', port=8765, max_concurrency=None, max_pending=32, timeout=120.0,
+                 max_body=256 * 2 ** 20, work_dir=None, events=None, image_root=None, mode='auto', window=None,
+                 precision=None, memory_cap=None):
+        self.host = host
+        self.port = port
+        self.max_concurrency = max_concurrency or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.max_body = max_body
+        self.work_dir = work_dir
+        self.image_root = image_root
+        self.mode = mode
+        self.window = window
+        self.precision = precision
+        self.memory_cap = memory_cap
+        self.pool = None
+        self.server = None
+        self.slots = None
+        self.started = None
+        self.waiting = 0
+        self.running = 0
+        self.counters = {'requests': 0, 'analyzed': 0, 'failed': 0, 'rejected': 0, 'timed_out': 0}
+        self.busy_seconds = 0.0
+        self.events = events or telemetry.EventStream(workers=self.max_concurrency)
+
+    async def start(self):
+        """
+        Starts the worker processes and begins listening. With port 0 a free port is picked, see self.port.
+        """
+        if self.work_dir is None:
+            self.work_dir = tempfile.mkdtemp(prefix='fiberfit_serve_')
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.pool = shared_arrays.SharedAnalysisPool(self.max_concurrency)
+        self.slots = asyncio.Semaphore(self.max_concurrency)
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.started = time.time()
+        self.events.run_started()
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.pool.shutdown(wait=True)
+        self.events.run_finished()
+
+    async def serve_forever(self):
+        await self.start()
+        print("FiberFit is serving on http://{host}:{port}".format(host=self.host, port=self.port))
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answers one request per connection.
+        """
+        try:
+            method, target, headers, body = await asyncio.wait_for(self.read_request(reader), self.timeout)
+            self.counters['requests'] += 1
+            status, payload = await self.dispatch(method, target, headers, body)
+        except HTTPError as e:
+            status, payload = e.status, {'error': str(e)}
+        except asyncio.TimeoutError:
+            status, payload = 400, {'error': 'request was not received in time'}
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        data = json.dumps(payload).encode('utf-8')
+        writer.write("HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {length}\r\n"
+                     "Connection: close\r\n\r\n".format(status=status, reason=REASONS[status],
+                                                        length=len(data)).encode('latin-1') + data)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def read_request(self, reader):
+        """
+        Returns: method, target, headers (lower case names) and body of an HTTP/1.1 request
+        """
+        try:
+            method, target, _ = (await reader.readline()).decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(400, 'malformed request line')
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError(400, 'malformed Content-Length')
+        if length > self.max_body:
+            raise HTTPError(413, 'request body is larger than {max} bytes'.format(max=self.max_body))
+        body = await reader.readexactly(length) if length else b''
+        return method, target, headers, body
+
+    async def dispatch(self, method, target, headers, body):
+        url = urllib.parse.urlsplit(target)
+        if url.path == '/health':
+            return 200, self.health()
+        if url.path == '/metrics':
+            return 200, self.metrics()
+        if url.path != '/analyze':
+            raise HTTPError(404, 'unknown endpoint {path}'.format(path=url.path))
+        if method != 'POST':
+            raise HTTPError(405, 'use POST')
+        return 200, await self.analyze(url.query, headers, body)
+
+    async def analyze(self, query, headers, body):
+        """
+        Queues one image to the worker processes and waits for its result.
+        """
+        directory = None
+        upload = None
+        try:
+            if headers.get('content-type', '').startswith('application/json'):
+                try:
+                    fields = json.loads(body.decode('utf-8'))
+                    path = fields['path']
+                except (ValueError, KeyError, TypeError):
+                    raise HTTPError(400, 'expected a JSON object with a "path"')
+                path = self.resolve_path(path)
+            else:
+                fields = dict(urllib.parse.parse_qsl(query))
+                if not body:
+                    raise HTTPError(400, 'expected the image as request body')
+                upload, path = tempfile.mkstemp(dir=self.work_dir, suffix=os.path.splitext(fields.get('name', ''))[1])
+                with os.fdopen(upload, 'wb') as image:
+                    image.write(body)
+            settings, distributions, images, bootstrap, engine, mixture = parse_settings(fields)
+            directory = tempfile.mkdtemp(dir=self.work_dir)
+            name = fields.get('name', 'upload') if upload is not None else path
+            start = time.time()
+            await self.acquire_slot(name)
+            self.running += 1
+            job = out = None
+            try:
+                loop = asyncio.get_running_loop()
+                try:
+                    reading = loop.run_in_executor(None, computerVision_BP.read_image, path, self.mode, self.window)
+                    im = await asyncio.wait_for(reading, max(self.timeout - (time.time() - start), 0))
+                except (OSError, ValueError) as e:
+                    raise HTTPError(400, 'the image could not be read: {error}'.format(error=e))
+                read = time.time() - start
+                if distributions:
+                    # the worker writes the distribution into a block of this process (see run_analysis)
+                    out = shared_arrays.SharedArray.create((2, computerVision_BP.angle_count(settings['angleInc'])))
+                job = self.pool.submit(run_analysis, im, path, settings, directory, images, bootstrap, engine,
+                                       mixture, self.precision, self.memory_cap, out=out)
+                record = await asyncio.wait_for(asyncio.wrap_future(job),
+                                                max(self.timeout - (time.time() - start), 0))
+                record['stages']['read'] = read
+                if out is not None:
+                    record['theta'] = out.array[1].tolist()
+                    record['normPower'] = out.array[0].tolist()
+            except HTTPError as e:
+                self.counters['failed'] += 1
+                self.events.image_failed(name, str(e), time.time() - start, self.waiting)
+                raise
+            except asyncio.TimeoutError:
+                self.counters['timed_out'] += 1
+                self.events.image_failed(name, 'timed out', time.time() - start, self.waiting)
+                raise HTTPError(504, 'analysis did not finish within {t} seconds'.format(t=self.timeout))
+            except Exception as e:
+                self.counters['failed'] += 1
+                self.events.image_failed(name, repr(e), time.time() - start, self.waiting)
+                raise HTTPError(500, repr(e))
+            finally:
+                self.release_slot(job, out)
+                self.busy_seconds += time.time() - start
+        finally:
+            if upload is not None:
+                os.remove(path)
+            if directory is not None:
+                # run_analysis removes it too, but not if the request failed before or timed out
+                shutil.rmtree(directory, ignore_errors=True)
+        self.counters['analyzed'] += 1
+        record['runtime'] = time.time() - start
+        self.events.image_finished(name, record['runtime'], record.pop('stages'), self.waiting)
+        if upload is not None:
+            record['name'] = pathlib.Path(fields.get('name', 'upload')).stem
+            record['path'] = fields.get('name')
+        return record
+
+    async def acquire_slot(self, name):
+        """
+        Takes a worker slot, waiting for one if none is free. Only requests that have to wait count as pending, and
+        they are rejected with 503 if max_pending requests are waiting already.
+        Args:
+            name: name of the image, for the events
+        """
+        if not self.slots.locked():
+            # a free slot is taken without yielding to the event loop, so no other request can get in between
+            await self.slots.acquire()
+            self.events.image_started(name, self.waiting)
+            return
+        if self.waiting >= self.max_pending:
+            self.counters['rejected'] += 1
+            raise HTTPError(503, 'too many pending requests')
+        self.events.image_started(name, self.waiting)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.counters['timed_out'] += 1
+            self.events.image_failed(name, 'timed out waiting for a worker', queued=self.waiting)
+            raise HTTPError(504, 'no worker became available in time')
+        finally:
+            self.waiting -= 1
+
+    def release_slot(self, job, out):
+        """
+        Gives the slot of a request back, with its output block, once its pool job is done. A job that has not
+        started yet is cancelled; one that is running (e.g. after a timeout) keeps the slot until it finishes, so
+        that no more than max_concurrency images are analyzed at the same time.
+        Args:
+            job: concurrent.futures.Future of the pool job, None if none was submitted
+            out: shared_arrays.SharedArray of the distribution, or None
+        """
+        def release():
+            if out is not None:
+                out.release()
+            self.running -= 1
+            self.slots.release()
+
+        if job is None or job.cancel() or job.done():
+            release()
+        else:
+            loop = asyncio.get_running_loop()
+            job.add_done_callback(lambda f: loop.call_soon_threadsafe(release))
+
+    def resolve_path(self, path):
+        """
+        Returns: the absolute path of an image named in a request, after checking that it lies inside image_root
+        """
+        if self.image_root is None:
+            raise HTTPError(403, 'this service only analyzes uploaded images, see serve --image-root')
+        root = pathlib.Path(self.image_root).resolve()
+        # resolving follows symbolic links, so a link can not lead out of the root either
+        target = (root / path).resolve()
+        if target != root and root not in target.parents:
+            raise HTTPError(403, '{path} is not inside the image root'.format(path=path))
+        return str(target)
+
+    def health(self):
+        return {'status': 'ok', 'workers': self.max_concurrency, 'running': self.running, 'waiting': self.waiting}
+
+    def metrics(self):
+        metrics = dict(self.counters)
+        metrics.update(uptime=time.time() - self.started, running=self.running, waiting=self.waiting,
+                       workers=self.max_concurrency, max_pending=self.max_pending, timeout=self.timeout,
+                       busy_seconds=self.busy_seconds)
+        return metrics
+
+
+def serve(host='127.0.0.1', port=8765, max_concurrency=None, max_pending=32, timeout=120.0, work_dir=None,
+          events=None, image_root=None, mode='auto', window=None, precision=None, memory_cap=None):
+    """
+    Runs the service until interrupted.
+    Args:
+        events: sink of the progress events, see telemetry.open_sink
+        image_root, mode, window, precision, memory_cap: see AnalysisService
+    """
+    service = AnalysisService(host, port, max_concurrency, max_pending, timeout, work_dir=work_dir,
+                              image_root=image_root, mode=mode, window=window, precision=precision,
+                              memory_cap=memory_cap)
+    service.events = telemetry.EventStream(events, workers=service.max_concurrency)
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
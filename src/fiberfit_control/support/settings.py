@@ -14,16 +14,22 @@ class SettingsWindow(QDialog, SettingsDialog.Ui_Dialog):
     genLCut = 32.0
     genAngInc = 1.0
     genRadStep = 0.5
-    sendValues = pyqtSignal(float, float, float, float)
+    genReplicates = 0
+    # Args: u_cut, l_cut, angle_inc, rad_step, number of bootstrap replicates
+    sendValues = pyqtSignal(float, float, float, float, int)
+    # emitted while the values are being edited, so that their effect can be previewed before they are applied
+    previewValues = pyqtSignal(float, float, float, float)
 
     def __init__(self, parent=None, screenDim = None):
         super(SettingsWindow, self).__init__(parent)
         self.setupUi(self, screenDim)
-        self.valuesStack = [(self.genUCut, self.genLCut, self.genAngInc, self.genRadStep)]
+        self.valuesStack = [(self.genUCut, self.genLCut, self.genAngInc, self.genRadStep, self.genReplicates)]
         self.buttonBox.button(QDialogButtonBox.Ok).clicked.connect(self.make_change)
         self.buttonBox.button(QDialogButtonBox.Reset).clicked.connect(self.reset_changes)
         self.setupDefaultValues()
         self.rejected.connect(self.reset_changes)
+        for field in (self.ttopField, self.tbottomField, self.btopField, self.bbottomField):
+            field.textEdited.connect(self.preview_change)
 
     def reset_changes(self):
         """
@@ -33,6 +39,8 @@ class SettingsWindow(QDialog, SettingsDialog.Ui_Dialog):
         self.tbottomField.setText(self.valuesStack[self.valuesStack.__len__() - 1][1].__str__())
         self.btopField.setText(self.valuesStack[self.valuesStack.__len__() - 1][2].__str__())
         self.bbottomField.setText(self.valuesStack[self.valuesStack.__len__() - 1][3].__str__())
+        self.replicatesField.setText(self.valuesStack[self.valuesStack.__len__() - 1][4].__str__())
+        self.preview_change()
 
     def setupDefaultValues(self):
         """
@@ -42,6 +50,7 @@ class SettingsWindow(QDialog, SettingsDialog.Ui_Dialog):
         self.tbottomField.setText(self.genLCut.__str__())
         self.btopField.setText(self.genAngInc.__str__())
         self.bbottomField.setText(self.genRadStep.__str__())
+        self.replicatesField.setText(self.genReplicates.__str__())
 
     @pyqtSlot()
     def make_change(self):
@@ -52,8 +61,21 @@ class SettingsWindow(QDialog, SettingsDialog.Ui_Dialog):
         lCut = float(self.tbottomField.text())
         angleInc = float(self.btopField.text())
         radStep = float(self.bbottomField.text())
-        self.valuesStack.append((uCut, lCut, angleInc, radStep))
-        self.sendValues.emit(uCut, lCut, angleInc, radStep)
+        replicates = int(self.replicatesField.text())
+        self.valuesStack.append((uCut, lCut, angleInc, radStep, replicates))
+        self.sendValues.emit(uCut, lCut, angleInc, radStep, replicates)
+
+    @pyqtSlot()
+    def preview_change(self):
+        """
+        Sends the values that are currently typed in to fiberfit.py for a live preview. Incomplete input is ignored.
+        """
+        try:
+            values = (float(self.ttopField.text()), float(self.tbottomField.text()),
+                      float(self.btopField.text()), float(self.bbottomField.text()))
+        except ValueError:
+            return
+        self.previewValues.emit(*values)
 
     @pyqtSlot()
     def do_change(self):
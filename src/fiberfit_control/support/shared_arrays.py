@@ -0,0 +1,161 @@
+"""
+Hands numpy arrays to worker processes through shared memory instead of pickling them.
+
+Pickling an image for a process pool copies it (at least) twice, and so does sending an array result back. A
+SharedArray lives in a multiprocessing.shared_memory block. Only its handle (name, shape and dtype) is pickled, and the
+worker maps the very same memory. This lets the parent decode (or otherwise prepare) the images and keep the workers
+busy with the analysis alone, and lets the workers write array results (e.g. the angular distribution) into a block
+the parent allocated, see service.AnalysisService.
+
+Lifetime: the process that creates a block owns it and must release() it, which unlinks the block. Processes that
+attach to a block only close their mapping. A block stays valid until its owner releases it, so the owner must not do
+that before the workers are done with it. SharedAnalysisPool takes care of this for the images it transfers; the
+output blocks belong to the caller, who releases them once the call is done.
+"""
+import concurrent.futures
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedArray:
+    """
+    numpy array backed by a shared memory block.
+
+    Attributes:
+        array: the array; None once released
+        owner: whether this process created the block (and hence unlinks it)
+    """
+    def __init__(self, shm, shape, dtype, owner):
+        self._shm = shm
+        self.array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        self.owner = owner
+
+    @classmethod
+    def create(cls, shape, dtype=float):
+        dtype = np.dtype(dtype)
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        return cls(shared_memory.SharedMemory(create=True, size=size), shape, dtype, owner=True)
+
+    @classmethod
+    def copy_of(cls, array):
+        """
+        Returns: new shared array with the content of array (the only copy made on the way to the worker)
+        """
+        shared = cls.create(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    @classmethod
+    def attach(cls, handle):
+        """
+        Maps a block created by another process.
+        Args:
+            handle: SharedArray.handle of the block
+        """
+        name, shape, dtype = handle
+        if sys.version_info >= (3, 13):
+            # the owner is responsible for unlinking, not the resource tracker of this process
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, shape, dtype, owner=False)
+
+    @property
+    def handle(self):
+        """
+        Returns: small, picklable reference to the block
+        """
+        return self._shm.name, self.array.shape, self.array.dtype.str
+
+    def release(self):
+        """
+        Closes the mapping and, if this process owns the block, unlinks it. Views of array must not be used
+        afterwards. Releasing twice does nothing.
+        """
+        if self._shm is None:
+            return
+        self.array = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # views of the array are still alive; the mapping goes away with the last of them
+            pass
+        if self.owner:
+            self._shm.unlink()
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def call_shared(function, image, *args, out=None):
+    """
+    Worker side of SharedAnalysisPool: calls function with an image in shared memory.
+    Args:
+        function: picklable (module level) function taking the image as its first argument
+        image: handle of the image
+        args: further arguments of function
+        out: handle of an output block, passed to function as its keyword argument out; None for none
+    Returns:
+        what function returns; it must not hold on to views of the image or the output block
+    """
+    im = SharedArray.attach(image)
+    output = SharedArray.attach(out) if out is not None else None
+    try:
+        if output is None:
+            return function(im.array, *args)
+        return function(im.array, *args, out=output.array)
+    finally:
+        im.release()
+        if output is not None:
+            output.release()
+
+
+class SharedAnalysisPool:
+    """
+    Process pool for functions of already decoded images, which transfers the images (and optionally an array
+    result) through shared memory.
+
+    Attributes:
+        workers: number of worker processes, defaults to the number of CPUs
+    """
+    def __init__(self, workers=None):
+        self.executor = concurrent.futures.ProcessPoolExecutor(workers)
+
+    def submit(self, function, im, *args, out=None):
+        """
+        Queues function(im, *args). The image is copied into shared memory once, and the block is released when the
+        call is done (or cancelled before it started).
+        Args:
+            function: picklable (module level) function taking the image as its first argument, e.g.
+                service.run_analysis
+            im: the image, see computerVision_BP.read_image
+            args: further (picklable) arguments of function
+            out: SharedArray the function writes its array result into (it gets out.array as its keyword argument
+                out), or None. It stays the caller's, who must not release it before the call is done.
+        Returns:
+            concurrent.futures.Future of the result of function
+        """
+        image = SharedArray.copy_of(im)
+        try:
+            future = self.executor.submit(call_shared, function, image.handle, *args,
+                                          out=out.handle if out is not None else None)
+        except Exception:
+            image.release()
+            raise
+        future.add_done_callback(lambda f: image.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
@@ -0,0 +1,158 @@
+"""
+Machine-readable progress of a run, as a stream of JSON lines.
+
+Every event is one JSON object per line with at least "event", "time" (seconds since the epoch) and "source" (which
+process sent it). The events are:
+    run_started     total number of images (if known) and number of workers
+    image_started   name of the image and the queue depth
+    image_finished  name, duration, the durations of the analysis stages and a progress snapshot
+    image_failed    name, error and a progress snapshot
+    run_finished    the final progress snapshot
+A progress snapshot holds the number of finished and failed images, images/s, the utilization of the workers (share of
+the elapsed time they spent on images), the queue depth and the estimated time to go (if the total is known).
+
+Events go to a file (appended to, so that the workers of a pooled run can share it), to standard output ('-'), or to
+a socket ('tcp://host:port' or 'udp://host:port'). A stream that has no sink, or whose sink fails, drops events, so
+telemetry never stops a run.
+"""
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import urllib.parse
+
+
+def open_sink(sink):
+    """
+    Args:
+        sink: file path, '-' for standard output, 'tcp://host:port' or 'udp://host:port'
+    Returns:
+        function writing one line
+    """
+    url = urllib.parse.urlsplit(sink)
+    if url.scheme == 'tcp':
+        connection = socket.create_connection((url.hostname, url.port), timeout=5)
+        return lambda line: connection.sendall(line.encode('utf-8'))
+    if url.scheme == 'udp':
+        connection = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        return lambda line: connection.sendto(line.encode('utf-8'), (url.hostname, url.port))
+    if sink == '-':
+        def write(line):
+            sys.stdout.write(line)
+            sys.stdout.flush()
+        return write
+    # line buffered, and in append mode every line is written at the end even if other processes write too
+    events = open(sink, 'a', buffering=1, encoding='utf-8')
+    return events.write
+
+
+class EventStream:
+    """
+    Emits the events of a run and keeps the counts its progress snapshots are computed from. Thread-safe.
+
+    Attributes:
+        source: identifies the sender, e.g. a work_queue worker id
+        workers: number of images that are processed at the same time
+        total: number of images of the run, if known
+    """
+    def __init__(self, sink=None, source=None, workers=1):
+        self.source = source or "{host}-{pid}".format(host=socket.gethostname(), pid=os.getpid())
+        self.workers = workers
+        self.total = None
+        self.started = time.time()
+        self.finished = 0
+        self.failed = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+        self._write = None
+        if sink:
+            try:
+                self._write = open_sink(sink)
+            except OSError as e:
+                print("Telemetry is off, {sink} can not be opened: {error}".format(sink=sink, error=e),
+                      file=sys.stderr)
+
+    def emit(self, event, **fields):
+        """
+        Sends one event.
+        Args:
+            event: name of the event
+            fields: data of the event; must be json-serializable
+        """
+        if self._write is None:
+            return
+        fields.update(event=event, time=time.time(), source=self.source)
+        line = json.dumps(fields, default=float) + '\n'
+        with self._lock:
+            try:
+                self._write(line)
+            except OSError:
+                self._write = None
+
+    def snapshot(self, queued=None):
+        """
+        Args:
+            queued: number of images waiting, if known
+        Returns:
+            dict with the progress so far
+        """
+        elapsed = max(time.time() - self.started, 1e-9)
+        done = self.finished + self.failed
+        rate = self.finished / elapsed
+        progress = {
+            'finished': self.finished,
+            'failed': self.failed,
+            'total': self.total,
+            'elapsed': elapsed,
+            'images_per_s': rate,
+            'utilization': min(self.busy / (elapsed * self.workers), 1.0),
+            'queue_depth': queued,
+        }
+        if self.total is not None:
+            remaining = max(self.total - done, 0)
+            progress['eta_s'] = remaining / rate if rate > 0 else None
+        elif queued is not None:
+            progress['eta_s'] = queued / rate if rate > 0 else None
+        return progress
+
+    def run_started(self, total=None):
+        """
+        Starts counting (again) from zero.
+        Args:
+            total: number of images of the run, if known
+        """
+        with self._lock:
+            self.total = total
+            self.started = time.time()
+            self.finished = 0
+            self.failed = 0
+            self.busy = 0.0
+        self.emit('run_started', total=total, workers=self.workers)
+
+    def image_started(self, name, queued=None):
+        self.emit('image_started', image=str(name), queue_depth=queued)
+
+    def image_finished(self, name, seconds, stages=None, queued=None):
+        """
+        Args:
+            name: the image
+            seconds: how long the image took
+            stages: durations of the analysis stages, see computerVision_BP.analyze_image
+            queued: number of images waiting, if known
+        """
+        with self._lock:
+            self.finished += 1
+            self.busy += seconds
+        self.emit('image_finished', image=str(name), seconds=seconds, stages=stages or {},
+                  progress=self.snapshot(queued))
+
+    def image_failed(self, name, error, seconds=0.0, queued=None):
+        with self._lock:
+            self.failed += 1
+            self.busy += seconds
+        self.emit('image_failed', image=str(name), error=str(error), seconds=seconds, progress=self.snapshot(queued))
+
+    def run_finished(self, queued=None):
+        self.emit('run_finished', progress=self.snapshot(queued))
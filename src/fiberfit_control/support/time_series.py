@@ -0,0 +1,59 @@
+"""
+Sequence mode: analyzes the frames of a time-lapse series or video (see sequence.SequenceAnalyzer) and streams the
+time series of the results to a csv file, one row per frame as soon as the frame is done, so that a long recording
+can be followed (or stopped) while it is analyzed.
+"""
+import csv
+
+from src.fiberfit_model import sequence
+from src.fiberfit_control.support import telemetry
+
+# Columns of the time series
+SERIES_HEADER = ['Frame', 'Source', 'Index', 'Time', 'Sig', 'Mu', 'K', 'R^2', 'Evaluations', 'Latency']
+
+
+def write_time_series(sources, output, u_cut, l_cut, angle_inc, rad_step, engine='spline', fps=None, events=None,
+                      mode='auto', window=None, precision=None, memory_cap=None):
+    """
+    Analyzes all frames of the sources in order and writes the time series.
+    Args:
+        sources: paths of the images (or multi-frame images) of the series, in order, or of videos
+        output: path of the csv file
+        u_cut: upper cut
+        l_cut: lower cut
+        angle_inc: angle increment
+        rad_step: radial step
+        engine: how to compute the angular distributions, one of computerVision_BP.HISTOGRAM_ENGINES
+        fps: frames per second, for the Time column; by default that of the video, if any, else Time is left empty
+        events: telemetry.EventStream to report the progress to, one image event per frame
+        mode, window, precision, memory_cap: how the frames are conformed and transformed, see
+            sequence.SequenceAnalyzer
+    Returns:
+        number of frames analyzed
+    """
+    analyzer = sequence.SequenceAnalyzer(u_cut, l_cut, angle_inc, rad_step, engine, mode, window, precision,
+                                         memoryCap=memory_cap)
+    events = events or telemetry.EventStream()
+    events.run_started()
+    frame = 0
+    rates = {}
+    try:
+        with open(output, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(SERIES_HEADER)
+            csvfile.flush()
+            for source, index, im in sequence.iter_frames(sources):
+                name = "{source}#{index}".format(source=source, index=index)
+                events.image_started(name)
+                if source not in rates:
+                    rates[source] = fps or sequence.frame_rate(source)
+                sig, k, th, R2, evaluations, latency = analyzer.analyze(im)
+                rate = rates[source]
+                writer.writerow([frame, source, index, '' if not rate else round(frame / rate, 6), round(sig, 4),
+                                 round(th, 4), round(k, 6), round(R2, 6), evaluations, round(latency, 6)])
+                csvfile.flush()
+                events.image_finished(name, latency)
+                frame += 1
+    finally:
+        events.run_finished()
+    return frame
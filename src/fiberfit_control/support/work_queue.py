@@ -0,0 +1,257 @@
+"""
+Distributed batch processing through a job queue on a shared filesystem.
+
+Any number of worker processes, on any number of machines that see the same directory, pull image paths from a
+SQLite job queue. No broker service is needed. A worker leases a job for a limited time. If it does not complete the
+job in time (e.g. because the machine died), the job goes back to the queue. Failed jobs are retried up to
+max_attempts times. Every worker appends its results to its own shard file, and the shards are merged once the queue
+is drained.
+
+Note: SQLite relies on the file locking of the shared filesystem. Use the default rollback journal (not WAL) on
+network filesystems.
+"""
+import csv
+import glob
+import json
+import os
+import pathlib
+import socket
+import sqlite3
+import time
+
+from src.fiberfit_control.support import analysis
+from src.fiberfit_control.support import telemetry
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobQueue:
+    """
+    Job queue stored in a SQLite database file.
+
+    Attributes:
+        path: path to the database file
+        lease_seconds: how long a worker may work on a job before it is handed out again
+        max_attempts: how many times a job is tried before it is given up on
+    """
+    def __init__(self, path, lease_seconds=600, max_attempts=3):
+        self.path = str(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            )""")
+
+    def close(self):
+        self.connection.close()
+
+    def enqueue(self, paths):
+        """
+        Adds images to the queue. Paths that are already queued are skipped.
+        Args:
+            paths: image paths
+        Returns:
+            number of jobs added
+        """
+        with self._transaction() as db:
+            before = db.total_changes
+            db.executemany("INSERT OR IGNORE INTO jobs (path) VALUES (?)", [(str(path),) for path in paths])
+            return db.total_changes - before
+
+    def claim(self, worker):
+        """
+        Leases the next pending job, or a job whose lease has expired.
+        Args:
+            worker: id of the worker
+        Returns:
+            (job id, path), or None if there is nothing to do right now
+        """
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("UPDATE jobs SET state = ?, error = 'lease expired' "
+                       "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                       (FAILED, LEASED, now, self.max_attempts))
+            row = db.execute("SELECT id, path FROM jobs WHERE state = ? OR (state = ? AND lease_expires < ?) "
+                             "ORDER BY id LIMIT 1", (PENDING, LEASED, now)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE jobs SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                       "WHERE id = ?", (LEASED, worker, now + self.lease_seconds, row[0]))
+            return row
+
+    def complete(self, job_id, worker):
+        """
+        Marks a job as done, unless its lease has meanwhile been taken over by another worker.
+        """
+        with self._transaction() as db:
+            db.execute("UPDATE jobs SET state = ?, lease_expires = NULL, error = NULL "
+                       "WHERE id = ? AND worker = ? AND state = ?", (DONE, job_id, worker, LEASED))
+
+    def fail(self, job_id, worker, error):
+        """
+        Puts a failed job back into the queue, or gives up on it after max_attempts attempts.
+        """
+        with self._transaction() as db:
+            db.execute("UPDATE jobs SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, lease_expires = NULL, "
+                       "error = ? WHERE id = ? AND worker = ? AND state = ?",
+                       (self.max_attempts, FAILED, PENDING, error, job_id, worker, LEASED))
+
+    def counts(self):
+        """
+        Returns: dict with the number of jobs in every state
+        """
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        for state, count in self.connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"):
+            counts[state] = count
+        return counts
+
+    def failures(self):
+        """
+        Returns: list of (path, error) of the jobs that were given up on
+        """
+        return self.connection.execute("SELECT path, error FROM jobs WHERE state = ? ORDER BY id",
+                                       (FAILED,)).fetchall()
+
+    def _transaction(self):
+        return _Transaction(self.connection)
+
+
+class _Transaction:
+    """
+    BEGIN IMMEDIATE ... COMMIT block, which takes the write lock up front so that two workers can not claim the same
+    job.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+
+def default_worker_id():
+    """
+    Returns: id that is unique among the workers sharing a queue
+    """
+    return "{host}-{pid}".format(host=socket.gethostname(), pid=os.getpid())
+
+
+def shard_path(output_dir, worker):
+    return os.path.join(output_dir, 'shard_' + worker + '.jsonl')
+
+
+def run_worker(queue_path, output_dir, u_cut, l_cut, angle_inc, rad_step, worker=None, lease_seconds=600,
+               max_attempts=3, poll_interval=5.0, bootstrap=0, events=None, engine='spline', mixture=0, mode='auto',
+               window=None, precision=None, memory_cap=None):
+    """
+    Processes jobs from the queue until no job is pending or leased anymore.
+    Args:
+        queue_path: path to the SQLite queue
+        output_dir: shared directory for the shards and the secondary images
+        u_cut: upper cut
+        l_cut: lower cut
+        angle_inc: angle increment
+        rad_step: radial step
+        worker: id of the worker, see default_worker_id
+        lease_seconds: see JobQueue
+        max_attempts: see JobQueue
+        poll_interval: how long to wait when all remaining jobs are leased by other workers
+        bootstrap: number of bootstrap replicates for the confidence intervals of k and mu, 0 for none
+        events: telemetry.EventStream to report the progress to
+        engine: how to compute the angular distributions, see analysis.analyze_file
+        mixture: largest number of components of the von Mises mixtures, 0 for none (see analysis.add_mixtures)
+        mode, window, precision, memory_cap: how the images are read and transformed, see analysis.analyze_file
+    Returns:
+        number of images processed by this worker
+    """
+    worker = worker or default_worker_id()
+    images_dir = os.path.join(output_dir, 'images')
+    os.makedirs(images_dir, exist_ok=True)
+    queue = JobQueue(queue_path, lease_seconds, max_attempts)
+    events = events or telemetry.EventStream(source=worker)
+    events.run_started()
+    processed = 0
+    try:
+        with open(shard_path(output_dir, worker), 'a') as shard:
+            while True:
+                job = queue.claim(worker)
+                if job is None:
+                    if queue.counts()[LEASED] == 0:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+                job_id, path = job
+                queued = queue.counts()[PENDING]
+                events.image_started(path, queued)
+                start = time.time()
+                timings = {}
+                try:
+                    # the job id is unique across workers, which makes it a safe name for the secondary images
+                    model = analysis.analyze_file(pathlib.Path(path), u_cut, l_cut, angle_inc, rad_step, images_dir,
+                                                  job_id, bootstrap=bootstrap, timings=timings,
+                                                  engine=engine, mixture=mixture, mode=mode, window=window,
+                                                  precision=precision, memory_cap=memory_cap)
+                    record = analysis.to_record(model, u_cut, l_cut, angle_inc, rad_step, images_dir)
+                    record['worker'] = worker
+                    shard.write(json.dumps(record) + '\n')
+                    shard.flush()
+                    os.fsync(shard.fileno())
+                except Exception as e:
+                    queue.fail(job_id, worker, repr(e))
+                    events.image_failed(path, repr(e), time.time() - start, queued)
+                    continue
+                queue.complete(job_id, worker)
+                events.image_finished(path, time.time() - start, timings, queued)
+                processed += 1
+    finally:
+        events.run_finished()
+        queue.close()
+    return processed
+
+
+def read_records(path):
+    """
+    Returns: result records of a json lines file
+    """
+    with open(path) as lines:
+        return [json.loads(line) for line in lines if line.strip()]
+
+
+def merge_shards(output_dir, summary=None):
+    """
+    Merges the shards of all workers into results.jsonl and a summary table (same format as the one exported from the
+    GUI). If a job was retried after its record had been written, the last record is kept.
+    Args:
+        output_dir: directory with the shards
+        summary: path of the summary table, output_dir/summary.csv by default
+    Returns:
+        the merged records, ordered by job
+    """
+    records = {}
+    for path in sorted(glob.glob(os.path.join(output_dir, 'shard_*.jsonl'))):
+        for record in read_records(path):
+            records[record['path']] = record
+    merged = sorted(records.values(), key=lambda record: record['number'])
+
+    with open(os.path.join(output_dir, 'results.jsonl'), 'w') as results:
+        for record in merged:
+            results.write(json.dumps(record) + '\n')
+    with open(summary or os.path.join(output_dir, 'summary.csv'), 'w') as csvfile:
+        a = csv.writer(csvfile)
+        a.writerow(analysis.SUMMARY_HEADER)
+        a.writerows([analysis.summary_row(record) for record in merged])
+    return merged
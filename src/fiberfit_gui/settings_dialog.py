@@ -107,6 +107,29 @@ class Ui_Dialog(object):
         self.horizontalLayout_2.addWidget(self.bfieldFrame)
         self.verticalLayout_3.addWidget(self.bottomFrame)
 
+        self.ciDescr = QtWidgets.QLabel(Dialog)
+        self.ciDescr.setWordWrap(True)
+        self.ciDescr.setContentsMargins(0, 0, 0, 0)
+        self.ciDescr.setObjectName("ciDescr")
+        self.verticalLayout_3.addWidget(self.ciDescr)
+
+        # frame containing the number of bootstrap replicates
+        self.ciFrame = QtWidgets.QFrame(Dialog)
+        self.ciFrame.setFrameShadow(QtWidgets.QFrame.Raised)
+        self.ciFrame.setObjectName("ciFrame")
+        self.horizontalLayout_3 = QtWidgets.QHBoxLayout(self.ciFrame)
+        self.horizontalLayout_3.setObjectName("horizontalLayout_3")
+        self.ciLabel = QtWidgets.QLabel(self.ciFrame)
+        self.ciLabel.setWordWrap(True)
+        self.ciLabel.setContentsMargins(0, 0, 0, 0)
+        self.ciLabel.setObjectName("ciLabel")
+        self.horizontalLayout_3.addWidget(self.ciLabel)
+        self.replicatesField = QtWidgets.QLineEdit(self.ciFrame)
+        self.replicatesField.setMaximumSize(QtCore.QSize(50, 50))
+        self.replicatesField.setObjectName("replicatesField")
+        self.horizontalLayout_3.addWidget(self.replicatesField)
+        self.verticalLayout_3.addWidget(self.ciFrame)
+
         self.buttonBox = QtWidgets.QDialogButtonBox(Dialog)
         self.buttonBox.setOrientation(QtCore.Qt.Horizontal)
         self.buttonBox.setStandardButtons(QtWidgets.QDialogButtonBox.Reset|QtWidgets.QDialogButtonBox.Ok)
@@ -134,4 +157,7 @@ class Ui_Dialog(object):
 "\nInput the increment for angle summation (degrees) and the interpolation increment for radial summation (pixels)."))
         self.bottomLabel.setText(_translate("Dialog", "Angle Increment: \n"
 "\n"
-"Radial Step Size: "))
\ No newline at end of file
+"Radial Step Size: "))
+        self.ciDescr.setText(_translate("Dialog", "<b>Confidence Intervals</b>:\n"
+"Number of bootstrap replicates for the 95% confidence intervals of k and μ (e.g. 1000), 0 for none."))
+        self.ciLabel.setText(_translate("Dialog", "Bootstrap Replicates: "))
\ No newline at end of file
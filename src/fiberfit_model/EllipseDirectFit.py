@@ -39,5 +39,46 @@ def EllipseDirectFit(XY):
     A[4] = A4
     A[5] = A5
     A = A / linalg.norm(A)
+    # the eigenvector has no definite sign, but orientation depends on it: use the one with A[0] + A[2] > 0
+    if A[0] + A[2] < 0:
+        A = -A
     return A, centroid
 
+
+
+def EllipseDirectFitBatch(XY):
+    """
+    Batched version of EllipseDirectFit. Fits an ellipse to each point set of a stack, solving all of the small 3x3
+    scatter and eigen problems with stacked linear algebra.
+    :param XY: array of shape (B, P, 2), B point sets of P points each
+    :return: A of shape (B, 6), the normalized conic coefficients of every fit, and centroid of shape (B, 2)
+    """
+    B = XY.shape[0]
+    centroid = np.mean(XY, axis=1)
+    X = XY[:, :, 0] - centroid[:, 0, None]
+    Y = XY[:, :, 1] - centroid[:, 1, None]
+    D1 = np.stack([X ** 2, X * Y, Y ** 2], axis=2)
+    D2 = np.stack([X, Y, np.ones_like(X)], axis=2)
+    D1T = np.swapaxes(D1, 1, 2)
+    S1 = np.matmul(D1T, D1)
+    S2 = np.matmul(D1T, D2)
+    S3 = np.matmul(np.swapaxes(D2, 1, 2), D2)
+    T = np.matmul(-np.linalg.inv(S3), np.swapaxes(S2, 1, 2))
+    M = S1 + np.matmul(S2, T)
+    M = np.stack([M[:, 2, :] / 2, - M[:, 1, :], M[:, 0, :] / 2], axis=1)
+    _eval, evec = np.linalg.eig(M)
+    cond = (4 * evec[:, 0, :] * evec[:, 2, :]) - (evec[:, 1, :] ** 2)
+    A1 = evec[np.arange(B), :, np.argmax(cond > 0, axis=1)]
+    A = np.concatenate([A1, np.matmul(T, A1[:, :, None])[:, :, 0]], axis=1)
+    cx = centroid[:, 0]
+    cy = centroid[:, 1]
+    A3 = A[:, 3] - 2 * A[:, 0] * cx - A[:, 1] * cy
+    A4 = A[:, 4] - 2 * A[:, 2] * cy - A[:, 1] * cx
+    A5 = A[:, 5] + A[:, 0] * cx ** 2 + A[:, 2] * cy ** 2 + A[:, 1] * cx * cy - A[:, 3] * cx - A[:, 4] * cy
+    A[:, 3] = A3
+    A[:, 4] = A4
+    A[:, 5] = A5
+    A = A / np.linalg.norm(A, axis=1, keepdims=True)
+    # same sign as EllipseDirectFit
+    A[A[:, 0] + A[:, 2] < 0] *= -1
+    return A, centroid
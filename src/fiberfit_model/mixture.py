@@ -0,0 +1,146 @@
+"""
+Mixtures of the distribution process_kappa fits, for images with more than one family of fibers (e.g. crossing
+fibers), where a single component fits poorly.
+
+On the doubled angle phi = 2 theta, exp(k cos(2 (theta - mu))) is a von Mises distribution, so the histogram is
+modelled as a mixture of von Mises distributions of phi and fitted by expectation-maximization, with the normalized
+power of every bin as its weight. The EM steps work on arrays of shape (images, components, angles), so that all
+components, and the histograms of a whole batch of images, are fitted together. The number of components is picked
+per image by the Bayesian information criterion, which only takes fitting every candidate number once for the batch.
+"""
+import numpy as np
+import scipy.special
+
+from src.fiberfit_model import computerVision_BP
+
+
+def mixture_log_density(phi, weights, mu, k):
+    """
+    :param phi: doubled angles (radians), shape (J,)
+    :param weights: mixing weights of shape (B, M)
+    :param mu: mean doubled angles of the components (radians), shape (B, M)
+    :param k: concentrations of the components, shape (B, M)
+    :return: log of weight * von Mises density of phi of every component, shape (B, M, J)
+    """
+    with np.errstate(divide='ignore'):
+        logWeights = np.log(weights)
+    return logWeights[:, :, None] + k[:, :, None] * (np.cos(phi - mu[:, :, None]) - 1) \
+        - np.log(2 * np.pi * scipy.special.i0e(k))[:, :, None]
+
+
+def initial_means(power, phi, components):
+    """
+    Starts the components at the highest peaks of the (smoothed) histograms, and at evenly spaced angles after the
+    highest peak where a histogram has fewer peaks than components.
+    :param power: histograms of shape (B, J)
+    :param phi: doubled angles (radians), shape (J,)
+    :param components: number of components
+    :return: mean doubled angles of shape (B, components)
+    """
+    smooth = sum(np.roll(power, shift, axis=1) for shift in range(-2, 3)) / 5
+    isPeak = (smooth > np.roll(smooth, 1, axis=1)) & (smooth >= np.roll(smooth, -1, axis=1))
+    score = np.where(isPeak, smooth, -np.inf)
+    order = np.argsort(-score, axis=1)[:, :components]
+    means = phi[order]
+    spread = means[:, :1] + 2 * np.pi * np.arange(components) / components
+    return np.where(np.isfinite(np.take_along_axis(score, order, axis=1)), means, spread)
+
+
+def fit_mixture(normPower, theta1RadFinal, components=2, maxIter=200, tolerance=1e-6):
+    """
+    Fits a mixture of `components` distributions to every histogram of a batch.
+    :param normPower: histograms of shape (B, number of angles), see computerVision_BP.process_histogram
+    :param theta1RadFinal: the angles (radians), evenly spaced over [0, pi)
+    :param components: number of components
+    :param maxIter: largest number of EM iterations
+    :param tolerance: the iterations stop once no log-likelihood changes by more than this
+    :return: weights, orientations (degrees, in [0, 180)) and concentrations of shape (B, components), sorted by
+        decreasing weight, the mean log-likelihood per bin (B,) and the number of iterations
+    """
+    phi = 2 * theta1RadFinal
+    power = np.clip(normPower, 0.0, None)
+    power = power / power.sum(axis=1, keepdims=True)
+    B = len(power)
+    # a component narrower than a bin is not resolved by the histogram, and would collapse onto a single bin
+    kMax = 1 / (phi[1] - phi[0]) ** 2
+
+    if components == 1:
+        k, t = computerVision_BP.moment_fit(power, theta1RadFinal)
+        mu = np.radians(2 * t)[:, None]
+    else:
+        mu = initial_means(power, phi, components)
+    weights = np.full((B, components), 1.0 / components)
+    k = np.ones((B, components))
+    cos, sin = np.cos(phi), np.sin(phi)
+
+    logLikelihood = np.full(B, -np.inf)
+    for iteration in range(1, maxIter + 1):
+        # E-step: responsibility of every component for every bin
+        logDensity = mixture_log_density(phi, weights, mu, k)
+        logTotal = scipy.special.logsumexp(logDensity, axis=1)
+        responsibility = np.exp(logDensity - logTotal[:, None, :])
+        previous, logLikelihood = logLikelihood, (power * logTotal).sum(axis=1)
+
+        # M-step: weighted circular moments of every component
+        weighted = responsibility * power[:, None, :]
+        mass = weighted.sum(axis=2)
+        C = weighted @ cos
+        S = weighted @ sin
+        weights = np.maximum(mass, 1e-12)
+        mu = np.arctan2(S, C)
+        k = np.minimum(computerVision_BP.a1inv(np.hypot(C, S) / weights), kMax)
+        if np.all(np.abs(logLikelihood - previous) < tolerance):
+            break
+
+    order = np.argsort(-weights, axis=1)
+    weights, mu, k = (np.take_along_axis(a, order, axis=1) for a in (weights, mu, k))
+    return weights, np.mod(np.degrees(mu / 2), 180), k, logLikelihood, iteration
+
+
+def mixture_distribution(theta1RadFinal, weights, orientations, k):
+    """
+    :param theta1RadFinal: the angles (radians)
+    :param weights: mixing weights of shape (B, M); NaN for components that are left out
+    :param orientations: orientations of the components (degrees), shape (B, M)
+    :param k: concentrations of the components, shape (B, M)
+    :return: the fitted distributions of shape (B, number of angles), normalized like process_kappa's
+    """
+    present = np.isfinite(weights)
+    weights, orientations, k = (np.where(present, a, b) for a, b in ((weights, 0.0), (orientations, 0.0), (k, 0.0)))
+    logDensity = mixture_log_density(2 * theta1RadFinal, weights, np.radians(2 * orientations), k)
+    # density of theta on [0, pi) is twice that of phi on [0, 2 pi)
+    return 2 * np.exp(scipy.special.logsumexp(logDensity, axis=1))
+
+
+def select_mixture(normPower, theta1RadFinal, maxComponents=3, maxIter=200, tolerance=1e-6):
+    """
+    Fits mixtures of 1 to maxComponents components to every histogram of a batch, and keeps the one with the lowest
+    Bayesian information criterion, counting every bin of the histogram as one observation.
+    :param normPower: histograms of shape (B, number of angles)
+    :param theta1RadFinal: the angles (radians)
+    :param maxComponents: largest number of components tried
+    :return: number of components (B,); weights, orientations (degrees) and concentrations of shape
+        (B, maxComponents), NaN beyond the number of components; and the R^2 of the selected fits (B,)
+    """
+    B, J = normPower.shape
+    shape = (B, maxComponents)
+    best = np.full(B, np.inf)
+    count = np.zeros(B, dtype=int)
+    weights, orientations, k = np.full(shape, np.nan), np.full(shape, np.nan), np.full(shape, np.nan)
+    for components in range(1, maxComponents + 1):
+        fit = fit_mixture(normPower, theta1RadFinal, components, maxIter, tolerance)
+        # 3 parameters per component, less one as the weights add up to 1
+        bic = -2 * J * fit[3] + (3 * components - 1) * np.log(J)
+        better = bic < best
+        best[better] = bic[better]
+        count[better] = components
+        for selected, fitted in zip((weights, orientations, k), fit[:3]):
+            selected[better] = np.nan
+            selected[better, :components] = fitted[better]
+
+    # squared correlation of the fit and the histogram, like the R^2 of process_kappa
+    fitted = mixture_distribution(theta1RadFinal, weights, orientations, k)
+    fitted = fitted - fitted.mean(axis=1, keepdims=True)
+    observed = normPower - normPower.mean(axis=1, keepdims=True)
+    R2 = (fitted * observed).sum(axis=1) ** 2 / ((fitted ** 2).sum(axis=1) * (observed ** 2).sum(axis=1))
+    return count, weights, orientations, k, R2
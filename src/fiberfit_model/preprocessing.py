@@ -0,0 +1,171 @@
+"""
+Preprocessing that brings an image to a square, FFT-friendly size before it is analyzed.
+
+FFT is fastest when the transform length only has small prime factors. Images of arbitrary camera resolutions
+(non-square, odd or prime-ish dimensions) can therefore be cropped to the largest or padded to the smallest even
+5-smooth square size. Cropping and padding are both centered, so the pixel axes, and hence the fiber orientation,
+are preserved. Optionally, the image is apodized first, which suppresses the cross-shaped artifact that the image
+borders (or the padding) leave in the power spectrum.
+
+By default ('auto') no pixel of a square image is dropped, as cropping changes the result: a square image is analyzed
+as it is (less a row and a column if its side is odd, as FiberFit always did), whether its side is fast or not, and
+only non-square images, which the analysis needs square, are padded. Cropping has to be asked for.
+"""
+import numpy as np
+
+MODES = ('auto', 'crop', 'pad')
+WINDOWS = (None, 'hann', 'tukey')
+
+
+def is_fast_len(n):
+    """
+    Checks whether n only has 2, 3 and 5 as prime factors.
+    :param n: positive integer
+    :return: True if n is 5-smooth
+    """
+    for p in (2, 3, 5):
+        while n % p == 0:
+            n //= p
+    return n == 1
+
+
+def next_fast_len(n):
+    """
+    :param n: positive integer
+    :return: the smallest even 5-smooth integer that is >= n
+    """
+    n = max(int(n), 2)
+    n += n % 2
+    while not is_fast_len(n):
+        n += 2
+    return n
+
+
+def prev_fast_len(n):
+    """
+    :param n: integer >= 2
+    :return: the largest even 5-smooth integer that is <= n
+    """
+    n = int(n)
+    n -= n % 2
+    while not is_fast_len(n):
+        n -= 2
+    return n
+
+
+def tukey(size, alpha=0.25):
+    """
+    Tukey (tapered cosine) window.
+    :param size: number of points
+    :param alpha: fraction of the window inside the cosine tapered region
+    :return: 1-D window
+    """
+    x = np.linspace(0.0, 1.0, size)
+    w = np.ones(size)
+    if alpha <= 0:
+        return w
+    edge = x < alpha / 2
+    w[edge] = 0.5 * (1 + np.cos(2 * np.pi / alpha * (x[edge] - alpha / 2)))
+    w[::-1][edge] = w[edge]
+    return w
+
+
+def apodize(im, window='hann', alpha=0.25):
+    """
+    Subtracts the mean from the image and multiplies it by a separable 2-D window.
+    :param im: 2-D image
+    :param window: 'hann' or 'tukey'
+    :param alpha: taper fraction of the Tukey window
+    :return: apodized float image
+    """
+    m, n = im.shape
+    if window == 'hann':
+        wy, wx = np.hanning(m), np.hanning(n)
+    elif window == 'tukey':
+        wy, wx = tukey(m, alpha), tukey(n, alpha)
+    else:
+        raise ValueError("Unknown window: {window}".format(window=window))
+    out = im.astype(float)
+    out -= out.mean()
+    out *= wy[:, None]
+    out *= wx[None, :]
+    return out
+
+
+def conformed_side(shape, mode='auto'):
+    """
+    :param shape: shape (m, n) of an image
+    :param mode: 'auto', 'crop' or 'pad', see conform_image
+    :return: side of the square conform_image makes of the image
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown mode: {mode}".format(mode=mode))
+    m, n = shape
+    if mode == 'auto' and m == n:
+        return m - m % 2
+    if mode == 'crop':
+        return prev_fast_len(min(m, n))
+    return next_fast_len(max(m, n))
+
+
+def conform_image(im, mode='auto', window=None):
+    """
+    Brings an image to an even square, see the module documentation.
+
+    'auto' leaves a square image as it is, except that the first row and column of an odd-sized one are removed, and
+    pads a non-square one like 'pad'.
+    'crop' keeps the central square of the largest such side that fits into the image. It only returns a view, and
+    for a square image whose side is already fast it is a no-op. If one row (column) has to go, it is the first one.
+    'pad' centers the image in the smallest such square that contains it, filled with the image mean (zero after
+    apodization). Note that padding changes the image size N, which the band-pass frequencies refer to.
+    :param im: 2-D image
+    :param mode: 'auto', 'crop' or 'pad'
+    :param window: None, 'hann' or 'tukey'
+    :return: square 2-D image
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown mode: {mode}".format(mode=mode))
+    if window not in WINDOWS:
+        raise ValueError("Unknown window: {window}".format(window=window))
+    m, n = im.shape
+
+    if mode == 'auto' and m == n:
+        im = im[m % 2:, n % 2:]
+        if window is not None:
+            im = apodize(im, window)
+        return im
+
+    if mode == 'crop':
+        side = prev_fast_len(min(m, n))
+        top = (m - side + 1) // 2
+        left = (n - side + 1) // 2
+        im = im[top:top + side, left:left + side]
+        if window is not None:
+            im = apodize(im, window)
+        return im
+
+    side = next_fast_len(max(m, n))
+    if window is not None:
+        im = apodize(im, window)
+        fill = 0.0
+    else:
+        fill = im.mean()
+    if (m, n) == (side, side):
+        return im
+    out = np.full((side, side), fill, dtype=np.result_type(im.dtype, float))
+    top = (side - m) // 2
+    left = (side - n) // 2
+    out[top:top + m, left:left + n] = im
+    return out
+
+
+def downsample(im, factor):
+    """
+    Area-averages non-overlapping factor x factor blocks, i.e. goes log2(factor) levels up an image pyramid.
+    Rows and columns that do not fill a whole block are dropped.
+    :param im: 2-D image
+    :param factor: integer block size
+    :return: float image of shape (m // factor, n // factor)
+    """
+    m, n = im.shape[0] // factor * factor, im.shape[1] // factor * factor
+    return im[:m, :n].reshape(m // factor, factor, n // factor, factor).mean(axis=(1, 3))
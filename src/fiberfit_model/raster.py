@@ -0,0 +1,107 @@
+"""
+Writes image panels (the original image and the log power spectrum) straight to PNG, without matplotlib.
+
+The panels are only ever shown at a few hundred pixels, so the image is first area-averaged to the panel size. Intensity
+is then scaled to 8 bits the way imshow does (minimum of the image black, maximum white), and the PNG is encoded with zlib. Apart
+from one pass over the image for the averaging, the cost does not depend on the image size.
+"""
+import struct
+import zlib
+
+import numpy as np
+import scipy.sparse
+
+# resolution the panels used to be saved at (matplotlib's default), i.e. a 4.5 in figure gives 450 pixels
+PANEL_DPI = 100
+
+
+def area_weights(n, size):
+    """
+    :param n: number of input pixels
+    :param size: number of output pixels
+    :return: sparse (size, n) matrix whose rows average the input pixels each output pixel covers, by overlap
+    """
+    step = n / size
+    lo = np.arange(size) * step
+    first = np.floor(lo).astype(int)
+    # an output pixel overlaps at most ceil(step) + 1 input pixels
+    span = int(np.ceil(step)) + 1
+    columns = first[:, None] + np.arange(span)[None, :]
+    overlap = np.minimum(lo[:, None] + step, columns + 1) - np.maximum(lo[:, None], columns)
+    keep = (overlap > 0) & (columns < n)
+    rows = np.broadcast_to(np.arange(size)[:, None], columns.shape)
+    return scipy.sparse.csr_matrix((overlap[keep] / step, (rows[keep], columns[keep])), shape=(size, n))
+
+
+def area_resize(im, shape):
+    """
+    Area-averages (or, for small images, stretches) a 2-D image to the given shape.
+    :param im: 2-D image
+    :param shape: (rows, columns) of the result
+    :return: float image of the given shape
+    """
+    rows, columns = shape
+    im = np.asarray(im, dtype=float)
+    averagedRows = area_weights(im.shape[0], rows) @ im
+    return (area_weights(im.shape[1], columns) @ averagedRows.T).T
+
+
+def intensity_range(im):
+    """
+    :return: minimum and maximum of the finite values of an image
+    """
+    finite = np.isfinite(im)
+    if finite.all():
+        return im.min(), im.max()
+    if not finite.any():
+        return 0.0, 0.0
+    return im[finite].min(), im[finite].max()
+
+
+def to_uint8(im, lo=None, hi=None):
+    """
+    Scales an image linearly from lo (black) to hi (white), clipping values outside the range.
+    :param im: 2-D float image
+    :param lo: intensity mapped to 0, by default the minimum of im
+    :param hi: intensity mapped to 255, by default the maximum of im
+    :return: uint8 image
+    """
+    if lo is None or hi is None:
+        lo, hi = intensity_range(im)
+    scale = 255.0 / (hi - lo) if hi > lo else 0.0
+    return np.round(np.clip(np.nan_to_num(im, nan=lo), lo, hi) * scale - lo * scale).astype(np.uint8)
+
+
+def _chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+
+def write_png(path, pixels):
+    """
+    Encodes an 8-bit grayscale PNG.
+    :param path: file to write
+    :param pixels: 2-D uint8 array, first row at the top
+    """
+    height, width = pixels.shape
+    # every scanline starts with its filter type, 0 (none)
+    scanlines = np.zeros((height, width + 1), dtype=np.uint8)
+    scanlines[:, 1:] = pixels
+    with open(path, 'wb') as png:
+        png.write(b'\x89PNG\r\n\x1a\n')
+        png.write(_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)))
+        png.write(_chunk(b'IDAT', zlib.compress(scanlines.tobytes(), 6)))
+        png.write(_chunk(b'IEND', b''))
+
+
+def save_panel(im, figWidth, figHeigth, path):
+    """
+    Saves a 2-D image as a grayscale panel of figWidth x figHeigth inches (stretched like imshow with aspect='auto').
+    The intensity range is that of the full image, as with imshow.
+    :param path: file to write, without the .png extension
+    :return: the uint8 panel
+    """
+    lo, hi = intensity_range(im)
+    resized = area_resize(im, (int(round(figHeigth * PANEL_DPI)), int(round(figWidth * PANEL_DPI))))
+    pixels = to_uint8(resized, lo, hi)
+    write_png(path + '.png', pixels)
+    return pixels
@@ -0,0 +1,168 @@
+"""
+Renders the angular (angDist) and cartesian (cartDist) distribution panels.
+
+Creating a figure for every image is the expensive part of plotting. Every new figure resolves the fonts again, which
+is especially slow where 'Times New Roman' is missing, builds new axes and ticks, and lays the whole figure out twice
+to find its tight bounding box. A DistributionRenderer builds both figures once, and for every image only updates the
+data of the lines and bars, the ticks and the limits. The tight bounding box of the polar plot is only recomputed when
+its tick labels change. The figures do not go through pyplot, so every thread can use its own renderer (see get_renderer).
+"""
+import threading
+
+import numpy as np
+from matplotlib import font_manager
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+FONT_FAMILY = 'Times New Roman'
+PAD_INCHES = 0.1
+
+_fonts = {}
+_fonts_lock = threading.Lock()
+_local = threading.local()
+
+
+def resolve_font(size=None):
+    """
+    Looks up FONT_FAMILY (or matplotlib's fallback) a single time per process.
+    :param size: font size, None for the default size
+    :return: FontProperties that refer to the font file directly
+    """
+    with _fonts_lock:
+        if 'path' not in _fonts:
+            _fonts['path'] = font_manager.findfont(font_manager.FontProperties(family=FONT_FAMILY))
+        return font_manager.FontProperties(fname=_fonts['path'], size=size)
+
+
+def tick_increment(maxValue):
+    """
+    :return: spacing of the intensity ticks for a distribution whose maximum is maxValue
+    """
+    if maxValue < 2:
+        return 0.5
+    elif maxValue < 5:
+        return 1
+    elif maxValue < 20:
+        return 5
+    return 10
+
+
+def get_renderer(figWidth, figHeigth):
+    """
+    :return: the DistributionRenderer of the current thread for the given figure size
+    """
+    renderer = getattr(_local, 'renderer', None)
+    if renderer is None or renderer.figsize != (figWidth, figHeigth):
+        renderer = _local.renderer = DistributionRenderer(figWidth, figHeigth)
+    return renderer
+
+
+class DistributionRenderer:
+    """
+    Reusable templates of the angDist and cartDist figures of process_ellipse and process_kappa.
+    """
+    def __init__(self, figWidth, figHeigth):
+        self.figsize = (figWidth, figHeigth)
+        self.ticksFont = resolve_font()
+        self.labelFont = resolve_font(size=14)
+        self._angular = None
+        self._cartesian = None
+        self._bars = []
+        self._bboxes = {}
+
+    def _new_figure(self):
+        figure = Figure(figsize=self.figsize)
+        FigureCanvasAgg(figure)
+        return figure
+
+    def _build_angular(self):
+        figure = self._new_figure()
+        ax = figure.add_subplot(111, projection='polar')
+        data, = ax.plot([], [], color='k', linewidth=2)
+        line, = ax.plot([], [], color='r', linewidth=3)
+        self._angular = figure, ax, data, line
+
+    def _build_cartesian(self):
+        figure = self._new_figure()
+        ax = figure.add_subplot(111)
+        fit, = ax.plot([], [], linewidth=3)
+        ax.set_xticks(np.arange(-360, 360, 45))
+        ax.set_xlabel('Angle (°)', fontproperties=self.labelFont)
+        ax.set_ylabel('Normalized Intensity', fontproperties=self.labelFont)
+        self._cartesian = figure, ax, fit
+
+    def _set_fonts(self, ax):
+        for label in ax.get_xticklabels() + ax.get_yticklabels():
+            label.set_fontproperties(self.ticksFont)
+
+    def _save(self, figure, key, path):
+        """
+        Saves a figure cropped to its tight bounding box. The box is looked up only once per key; with key None, it
+        is looked up every time (which is still cheaper than savefig's bbox_inches='tight').
+        """
+        bbox = self._bboxes.get(key)
+        if bbox is None:
+            bbox = figure.get_tightbbox(figure.canvas.get_renderer()).padded(PAD_INCHES)
+            if key is not None:
+                self._bboxes[key] = bbox
+        figure.savefig(path, bbox_inches=bbox)
+
+    def draw_angular(self, theta, power, t, path):
+        """
+        Draws the polar plot of the (mirrored) angular distribution with the orientation as a red line.
+        :param theta: angles (radians) over the full circle
+        :param power: distribution at theta
+        :param t: orientation (degrees)
+        :param path: where to save the figure (png)
+        :return: the figure, which is redrawn for the next image
+        """
+        if self._angular is None:
+            self._build_angular()
+        figure, ax, data, line = self._angular
+        maxPower = max(power)
+        r_line = np.arange(0, maxPower + .5, .5)
+        data.set_data(theta, power)
+        line.set_data(np.concatenate([np.full(len(r_line), t), np.full(len(r_line), t + 180)]) * np.pi / 180,
+                      np.concatenate([r_line, r_line]))
+        ax.relim()
+        ax.autoscale_view()
+        inc = tick_increment(maxPower)
+        ticks = np.arange(inc, maxPower, inc)
+        ax.set_yticks(ticks)
+        self._set_fonts(ax)
+        self._save(figure, ('angular', tuple(ticks)), path)
+        return figure
+
+    def draw_cartesian(self, theta, power, fit, t, path):
+        """
+        Draws the bar plot of the angular distribution, centered on the orientation, with the fitted distribution.
+        :param theta: angles (radians), shifted so that t is in the middle
+        :param power: distribution at theta
+        :param fit: fitted distribution at theta
+        :param t: orientation (degrees)
+        :param path: where to save the figure (png)
+        :return: the figure, which is redrawn for the next image
+        """
+        if self._cartesian is None:
+            self._build_cartesian()
+        figure, ax, fitLine = self._cartesian
+        degrees = theta * 180 / np.pi
+        if len(self._bars) != len(degrees):
+            for bar in self._bars:
+                bar.remove()
+            self._bars = list(ax.bar(degrees, power, edgecolor='k', color='k'))
+        else:
+            for bar, x, height in zip(self._bars, degrees, power):
+                bar.set_x(x - bar.get_width() / 2)
+                bar.set_height(height)
+        fitLine.set_data(degrees, fit)
+        ax.set_xlim([t - 100, t + 100])
+        top = max(power) + .3
+        inc = tick_increment(max(power))
+        ticks = np.arange(0, top, inc)
+        ax.set_yticks(ticks)
+        ax.set_ylim([0, top])
+        self._set_fonts(ax)
+        # the angle tick labels near the limits stick out of the axes by varying amounts
+        self._save(figure, None, path)
+        return figure
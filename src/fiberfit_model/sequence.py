@@ -0,0 +1,168 @@
+"""
+Analysis of image sequences: time-lapse series of image files, multi-frame images (e.g. TIFF stacks) and videos.
+
+The frames of a sequence show the same field, so they have the same size and change little from one frame to the
+next. SequenceAnalyzer therefore keeps what only depends on the frame size (the polar sampling of the spline, see
+computerVision_BP.PolarSampler, or the bins of the bincount engine) across frames, and starts the fit of k at the k of
+the previous frame rather than at a fixed guess. The orientation comes from the closed-form ellipse fit, which needs no
+starting value. No figures are made, so a frame only costs its FFT, its histogram and the fits.
+
+Videos are read with imageio (with its ffmpeg plugin), which is only needed for them.
+"""
+import os
+import time
+
+import numpy as np
+import scipy.optimize
+import scipy.stats
+from PIL import Image, ImageSequence
+
+try:
+    import imageio.v3 as iio
+except ImportError:
+    iio = None
+
+from src.fiberfit_model import computerVision_BP
+from src.fiberfit_model import preprocessing
+
+VIDEO_SUFFIXES = ('.avi', '.mkv', '.mov', '.mp4', '.mpg', '.wmv')
+# PIL modes whose pixels are gray values; the others (palette, color, alpha) are converted to luminance
+GRAY_MODES = ('L', 'I', 'I;16', 'I;16B', 'I;16L', 'F')
+
+
+def to_gray(frame):
+    """
+    :param frame: 2-D gray or 3-D color frame
+    :return: 2-D frame, the mean of the color channels for a color frame
+    """
+    frame = np.asarray(frame)
+    if frame.ndim == 3:
+        frame = frame[..., :3].mean(axis=2)
+    return frame
+
+
+def image_to_gray(image):
+    """
+    :param image: PIL image, e.g. a frame of a multi-frame file
+    :return: 2-D frame of the gray values, or of the luminance for palette, color and alpha modes
+    """
+    if image.mode not in GRAY_MODES:
+        image = image.convert('L')
+    return np.asarray(image)
+
+
+def iter_frames(sources):
+    """
+    Reads the frames of a sequence one at a time.
+    :param sources: paths of image files (one frame each, or a multi-frame TIFF or GIF) or of videos, in order
+    :return: generator of (source, index of the frame in the source, 2-D frame)
+    """
+    for source in sources:
+        if os.path.splitext(str(source))[1].lower() in VIDEO_SUFFIXES:
+            if iio is None:
+                raise ImportError("Reading videos needs imageio: pip install imageio[ffmpeg]")
+            for index, frame in enumerate(iio.imiter(source)):
+                yield source, index, to_gray(frame)
+        else:
+            with Image.open(source) as image:
+                for index, frame in enumerate(ImageSequence.Iterator(image)):
+                    yield source, index, image_to_gray(frame)
+
+
+def frame_rate(source):
+    """
+    :param source: path of a video
+    :return: frames per second of the video, or None if it is not a video or the rate is unknown
+    """
+    if iio is None or os.path.splitext(str(source))[1].lower() not in VIDEO_SUFFIXES:
+        return None
+    return iio.immeta(source).get('fps')
+
+
+def fit_kappa_warm(t_final, theta1RadFinal, normPower, c0):
+    """
+    Fits k like computerVision_BP.fit_kappa, starting at c0, with the normalization of the distribution in closed
+    form (computerVision_BP.kappa_density, valid for k of either sign) rather than by quadrature.
+    :param t_final: orientation (degrees)
+    :param theta1RadFinal: the angles (radians)
+    :param normPower: angular histogram
+    :param c0: starting value of k
+    :return: k, R^2 of the fit and the number of evaluations of the distribution the fit took
+    """
+    t_final_rad = t_final * np.pi / 180
+
+    def fitted_func(thetas, c):
+        return computerVision_BP.kappa_density(thetas, t_final_rad, c)
+
+    kappa, kappa_pcov, info, message, status = scipy.optimize.curve_fit(
+        f=fitted_func, p0=(c0,), xdata=theta1RadFinal, ydata=normPower, full_output=True)
+    slope, intercept, rValue, pValue, stderr = scipy.stats.linregress(fitted_func(theta1RadFinal, kappa[0]),
+                                                                      normPower)
+    return kappa[0], rValue ** 2, info['nfev']
+
+
+class SequenceAnalyzer:
+    """
+    Analyzes the frames of a sequence one after the other, see the module documentation.
+
+    Attributes:
+        k: k of the previous frame, where the fit of the next one starts (None before the first frame)
+        samplers: computerVision_BP.PolarSampler of every frame size seen, for the spline engine
+    """
+    def __init__(self, uCut, lCut, angleInc, radStep, engine='spline', mode='auto', window=None, precision=None,
+                 c0=15, memoryCap=None):
+        """
+        :param uCut: upper-cut parameter from the settings.SettingsWindow
+        :param lCut: lower-cut parameter form the settings.SettingsWindow
+        :param angleInc: angle-increment
+        :param radStep: radial-step
+        :param engine: how to compute the angular histogram, one of computerVision_BP.HISTOGRAM_ENGINES
+        :param mode: 'auto', 'crop' or 'pad', see preprocessing.conform_image
+        :param window: apodization window, None, 'hann' or 'tukey'
+        :param precision: floating point type of the spectra, see computerVision_BP.spectrum_dtype
+        :param c0: starting value of k for the first frame, as in process_kappa
+        :param memoryCap: largest number of bytes the spectrum of a frame may take up, None for no limit
+        """
+        if engine not in computerVision_BP.HISTOGRAM_ENGINES:
+            raise ValueError("Unknown histogram engine: {engine}".format(engine=engine))
+        self.uCut, self.lCut, self.angleInc, self.radStep = uCut, lCut, angleInc, radStep
+        self.engine = engine
+        self.mode = mode
+        self.window = window
+        self.precision = precision
+        self.c0 = c0
+        self.memoryCap = memoryCap
+        self.k = None
+        self.samplers = {}
+
+    def histogram(self, PabsFlip, N1):
+        """
+        :return: normPower, theta1RadFinal of a spectrum, as computerVision_BP.process_histogram
+        """
+        if self.engine != 'spline':
+            # the bins of the bincount engine are cached per size by histogram_bins
+            return computerVision_BP.HISTOGRAM_ENGINES[self.engine](PabsFlip, N1, self.uCut, self.lCut,
+                                                                    self.angleInc, self.radStep)
+        sampler = self.samplers.get(N1)
+        if sampler is None:
+            sampler = self.samplers[N1] = computerVision_BP.PolarSampler(N1, self.uCut, self.lCut, self.angleInc,
+                                                                         self.radStep)
+        PowerYFinal = sampler.sample(PabsFlip[None])[0].sum(axis=1)
+        power_area = np.trapz(PowerYFinal, sampler.theta1RadFinal)
+        return PowerYFinal / power_area, sampler.theta1RadFinal
+
+    def analyze(self, frame):
+        """
+        Analyzes the next frame.
+        :param frame: 2-D frame
+        :return: sig, k, th, R^2, the number of evaluations the fit of k took and the time the frame took (s)
+        """
+        start = time.time()
+        im = preprocessing.conform_image(frame, self.mode, self.window)
+        PabsFlip = computerVision_BP.power_spectrum(im, self.precision, self.memoryCap)
+        normPower, theta1RadFinal = self.histogram(PabsFlip, im.shape[1])
+        t_final = computerVision_BP.ellipse_orientations(normPower[None], theta1RadFinal)[0]
+        k, R2, evaluations = fit_kappa_warm(t_final, theta1RadFinal, normPower,
+                                            self.c0 if self.k is None else self.k)
+        self.k = k
+        return computerVision_BP.kappa_sigma(k), k, t_final, R2, evaluations, time.time() - start
@@ -0,0 +1,65 @@
+import collections
+import threading
+
+
+class SpectrumCache:
+    """
+    Bounded, thread-safe least-recently-used cache of power spectra (PabsFlip, see computerVision_BP.power_spectrum).
+
+    Only the histogram, ellipse and kappa steps depend on the settings, so keeping the spectra of the loaded images
+    around lets setting changes be applied without reading and transforming the images again. Entries are evicted,
+    least recently used first, once their total size exceeds maxBytes.
+    """
+    def __init__(self, maxBytes=512 * 2 ** 20):
+        """
+        :param maxBytes: largest total number of bytes of the cached spectra
+        """
+        self.maxBytes = maxBytes
+        self.nbytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key, PabsFlip, N1):
+        """
+        Stores a spectrum. Spectra larger than the whole cache are not stored.
+        :param key: identifies the image, e.g. str of its path
+        :param PabsFlip: the power spectrum; it must not be modified afterwards
+        :param N1: size of the image the spectrum was computed from
+        """
+        if PabsFlip.nbytes > self.maxBytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (PabsFlip, N1)
+            self.nbytes += PabsFlip.nbytes
+            while self.nbytes > self.maxBytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def get(self, key):
+        """
+        :param key: identifies the image
+        :return: (PabsFlip, N1), or None if the spectrum is not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[0].nbytes
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
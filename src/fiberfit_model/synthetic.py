@@ -0,0 +1,75 @@
+"""
+Synthetic fiber images with a known orientation distribution, for benchmarks and accuracy checks.
+
+Like the images in test_images, a synthetic image is a set of straight bright fibers on a dark background. The
+orientations of the fibers are drawn from the distribution process_kappa fits, exp(k cos(2 (theta - mu))), so the
+result of the analysis can be compared to the mu and k the image was made with. Drawing costs time proportional to the
+number of fiber pixels, so images of any size the memory allows can be made quickly.
+"""
+import numpy as np
+
+from src.fiberfit_model import raster
+
+
+def fiber_orientations(count, mu, k, rng):
+    """
+    Draws orientations from exp(k cos(2 (theta - mu))) on [0, 180) degrees, i.e. a von Mises distribution of the
+    doubled angle.
+    :param count: number of orientations
+    :param mu: mean orientation (degrees)
+    :param k: concentration, 0 for uniformly distributed orientations
+    :param rng: np.random.Generator
+    :return: orientations (radians)
+    """
+    doubled = rng.vonmises(2 * mu * np.pi / 180, k, count) if k > 0 else rng.uniform(-np.pi, np.pi, count)
+    return np.mod(doubled / 2, np.pi)
+
+
+def fiber_image(size, mu, k, noise=0.0, coverage=0.035, length=0.25, width=1, seed=None, chunk=2 ** 20):
+    """
+    Makes a square fiber image.
+    :param size: side of the image (pixels)
+    :param mu: orientation FiberFit should report (degrees)
+    :param k: concentration of the orientations, 0 for an isotropic image
+    :param noise: standard deviation of white noise added to the image, relative to the fiber intensity
+    :param coverage: approximate fraction of the pixels covered by fibers (about that of the images in test_images)
+    :param length: length of the fibers, relative to the size
+    :param width: width of the fibers (pixels)
+    :param seed: seed of the fiber positions, orientations and noise
+    :param chunk: largest number of fiber points drawn at once, which bounds the memory drawing takes
+    :return: 2-D float image with values from 0 to 255
+    """
+    rng = np.random.default_rng(seed)
+    im = np.zeros((size, size))
+    fiberLength = max(length * size, 1.0)
+    count = max(int(round(coverage * size * size / (fiberLength * width))), 1)
+    # orientations are counterclockwise from the column axis as FiberFit reports them, and the row axis points down
+    theta = fiber_orientations(count, mu, k, rng)
+    centers = rng.uniform(0, size, (count, 2))
+    # half-pixel steps along the fibers leave no gaps
+    steps = np.arange(-fiberLength / 2, fiberLength / 2, 0.5)
+    offsets = np.arange(width) - (width - 1) / 2
+    perFiber = max(chunk // (len(steps) * len(offsets)), 1)
+    for first in range(0, count, perFiber):
+        angles = theta[first:first + perFiber, None, None]
+        rowsCenter = centers[first:first + perFiber, 0, None, None]
+        columnsCenter = centers[first:first + perFiber, 1, None, None]
+        along = steps[None, :, None]
+        across = offsets[None, None, :]
+        rows = np.round(rowsCenter - along * np.sin(angles) + across * np.cos(angles)).astype(np.int64).ravel()
+        columns = np.round(columnsCenter + along * np.cos(angles) + across * np.sin(angles)).astype(np.int64).ravel()
+        inside = (rows >= 0) & (rows < size) & (columns >= 0) & (columns < size)
+        im[rows[inside], columns[inside]] = 255
+    if noise > 0:
+        im += rng.normal(0, noise * 255, im.shape)
+        np.clip(im, 0, 255, out=im)
+    return im
+
+
+def save_image(im, path):
+    """
+    Saves a synthetic image as an 8-bit grayscale PNG, e.g. to run it through the GUI.
+    :param im: 2-D image with values from 0 to 255
+    :param path: file to write
+    """
+    raster.write_png(path, np.round(im).astype(np.uint8))
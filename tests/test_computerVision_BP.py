@@ -0,0 +1,229 @@
+"""
+Checks that the faster paths of computerVision_BP give the results of the straightforward computations they replace.
+"""
+import glob
+import math
+import os
+
+import numpy as np
+import pytest
+import scipy.integrate
+import scipy.interpolate
+from PIL import Image
+
+from src.fiberfit_model import EllipseDirectFit
+from src.fiberfit_model import computerVision_BP
+from src.fiberfit_model import preprocessing
+from src.fiberfit_model import synthetic
+
+# default settings of settings.SettingsWindow
+U_CUT, L_CUT, ANGLE_INC, RAD_STEP = 2.0, 32.0, 1.0, 0.5
+TEST_IMAGES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test_images')
+
+
+def read_test_image(prefix):
+    """
+    :return: the image of test_images whose name starts with prefix, as it is stored
+    """
+    name, = glob.glob(os.path.join(TEST_IMAGES, glob.escape(prefix) + '*'))
+    return np.asarray(Image.open(name))
+
+
+def fit_distribution(PabsFlip, N1, angleInc=ANGLE_INC, engine='spline'):
+    """
+    :return: k and mu of a spectrum, as process_distribution finds them (without the plots)
+    """
+    normPower, theta1RadFinal = computerVision_BP.HISTOGRAM_ENGINES[engine](PabsFlip, N1, U_CUT, L_CUT, angleInc,
+                                                                           RAD_STEP)
+    t_final = computerVision_BP.ellipse_orientations(normPower[None], theta1RadFinal)[0]
+    kappa, fitted_func = computerVision_BP.fit_kappa(t_final, theta1RadFinal, normPower)
+    return kappa[0], t_final
+
+
+def reference_spectrum(im):
+    """
+    The spectrum as it was computed before power_spectrum: full fft2, shifted, rotated, flipped, first row and
+    column deleted.
+    """
+    Pabs = np.abs(np.fft.fftshift(np.fft.fft2(im))) ** 2
+    PabsFlip = np.flipud(np.rot90(Pabs))
+    return PabsFlip[1:, 1:]
+
+
+def reference_histogram(PabsFlip, N1, uCut, lCut, angleInc, radStep):
+    """
+    The histogram as it was computed before the spectrum was cropped to the band: a spline of the whole spectrum,
+    sampled one ray at a time.
+    """
+    n1 = np.round(N1 / 2) - 1
+    freq = np.arange(-n1, n1 + 1, 1)
+    theta1Rad = np.linspace(0.0, 2 * math.pi, num=int(360 / angleInc))
+    rho1 = np.linspace(uCut, lCut, num=int((lCut - uCut) / radStep))
+    PowerSpline = scipy.interpolate.RectBivariateSpline(y=freq, x=freq, z=PabsFlip)
+    PowerY = np.array([PowerSpline.ev(rho1 * math.sin(theta), rho1 * math.cos(theta)).sum() for theta in theta1Rad])
+    PowerYFinal = PowerY[0:len(theta1Rad) // 2]
+    theta1RadFinal = theta1Rad[0:len(theta1Rad) // 2]
+    return PowerYFinal / np.trapz(PowerYFinal, theta1RadFinal), theta1RadFinal
+
+
+def relative_error(actual, expected):
+    return np.abs(actual - expected).max() / np.abs(expected).max()
+
+
+@pytest.fixture(scope='module')
+def images():
+    return np.stack([synthetic.fiber_image(256, mu, k, seed=seed) for mu, k, seed in ((30, 4, 1), (120, 1, 2),
+                                                                                      (75, 16, 3))])
+
+
+@pytest.mark.parametrize('shape', [(8, 8), (6, 10), (64, 48), (3, 16, 20)])
+def test_power_spectrum_matches_fft2(shape):
+    im = np.random.default_rng(0).random(shape)
+    PabsFlip = computerVision_BP.power_spectrum(im)
+    expected = np.stack([reference_spectrum(image) for image in im.reshape((-1,) + shape[-2:])]).reshape(
+        PabsFlip.shape)
+    assert relative_error(PabsFlip, expected) < 1e-12
+    assert relative_error(computerVision_BP.power_spectrum(im, 'float32'), expected) < 1e-5
+
+
+def test_band_spectrum_matches_whole_spectrum_spline(images):
+    N1 = images.shape[-1]
+    PabsFlip = computerVision_BP.power_spectrum(images[0])
+    normPower, theta1RadFinal = computerVision_BP.process_histogram(PabsFlip, N1, U_CUT, L_CUT, ANGLE_INC, RAD_STEP)
+    expected, expectedTheta = reference_histogram(PabsFlip, N1, U_CUT, L_CUT, ANGLE_INC, RAD_STEP)
+    np.testing.assert_array_equal(theta1RadFinal, expectedTheta)
+    assert relative_error(normPower, expected) < 1e-10
+
+
+def test_batch_matches_single_images(images):
+    N1 = images.shape[-1]
+    PabsFlipStack = computerVision_BP.power_spectrum(images)
+    normPowerStack, theta1RadFinal = computerVision_BP.process_histogram_batch(PabsFlipStack, N1, U_CUT, L_CUT,
+                                                                              ANGLE_INC, RAD_STEP)
+    for PabsFlip, normPower in zip(PabsFlipStack, normPowerStack):
+        expected, expectedTheta = computerVision_BP.process_histogram(PabsFlip, N1, U_CUT, L_CUT, ANGLE_INC,
+                                                                      RAD_STEP)
+        np.testing.assert_array_equal(theta1RadFinal, expectedTheta)
+        assert relative_error(normPower, expected) < 1e-10
+
+
+def test_image_batch_decodes_one_chunk_at_a_time(tmp_path, monkeypatch):
+    names = []
+    for i, shape in enumerate([(128, 128), (96, 100), (128, 128), (96, 100), (128, 128)]):
+        im = synthetic.fiber_image(128, 30 * i, 4, seed=i)[:shape[0], :shape[1]]
+        names.append(tmp_path / 'image{i}.png'.format(i=i))
+        Image.fromarray(np.round(255 * im).astype(np.uint8)).save(names[-1])
+    decoded = []
+    stacked = []
+    read_image = computerVision_BP.read_image
+    power_spectrum = computerVision_BP.power_spectrum
+
+    def counting_read(name, *args):
+        decoded.append(name)
+        return read_image(name, *args)
+
+    def counting_spectrum(im, *args):
+        stacked.append((len(im), len(decoded)))
+        return power_spectrum(im, *args)
+
+    monkeypatch.setattr(computerVision_BP, 'read_image', counting_read)
+    monkeypatch.setattr(computerVision_BP, 'power_spectrum', counting_spectrum)
+    results = computerVision_BP.process_image_batch(names, U_CUT, L_CUT, ANGLE_INC, RAD_STEP, None, None,
+                                                    str(tmp_path), 0, maxBatch=2)
+    # three 128 px squares and two 96x100 images padded to 100 px, in chunks of at most 2
+    assert [count for count, total in stacked] == [2, 1, 2]
+    # every chunk is decoded just before it is transformed
+    assert [total for count, total in stacked] == list(np.cumsum([count for count, total in stacked]))
+    monkeypatch.undo()
+    for i, name in enumerate(names):
+        sig, k, th, R2 = computerVision_BP.process_image(name, U_CUT, L_CUT, ANGLE_INC, RAD_STEP, None, None,
+                                                         str(tmp_path), 10 + i)[:4]
+        assert results[i][1:3] == pytest.approx((k, th), abs=1e-6)
+
+
+def test_single_band_matches_histogram(images):
+    N1 = images.shape[-1]
+    PabsFlip = computerVision_BP.power_spectrum(images[1])
+    normPower, theta1RadFinal, edges = computerVision_BP.process_histogram_bands(PabsFlip, N1, U_CUT, L_CUT,
+                                                                                 ANGLE_INC, RAD_STEP, [U_CUT, L_CUT])
+    expected, expectedTheta = computerVision_BP.process_histogram(PabsFlip, N1, U_CUT, L_CUT, ANGLE_INC, RAD_STEP)
+    assert normPower.shape == (1, len(expected))
+    assert relative_error(normPower[0], expected) < 1e-12
+
+
+def test_ellipse_orientations_match_single_fits():
+    # noisy von Mises histograms; for about a quarter of them the orientation depends on the sign of the conic
+    rng = np.random.default_rng(0)
+    theta1RadFinal = np.linspace(0.0, 2 * math.pi, 360)[:180]
+    mu = rng.uniform(0.0, math.pi, (1000, 1))
+    k = rng.uniform(0.01, 5.0, (1000, 1))
+    normPower = np.exp(k * np.cos(2 * (theta1RadFinal - mu)))
+    normPower = np.abs(normPower * (1 + rng.normal(0.0, 0.3, normPower.shape) * rng.uniform(0.0, 1.0, mu.shape)))
+    normPower /= np.trapz(normPower, theta1RadFinal)[:, None]
+    expected = []
+    for power in normPower:
+        xdata, ydata = computerVision_BP.pol2cart(np.concatenate([theta1RadFinal, theta1RadFinal + np.pi]),
+                                                  np.concatenate([power, power]))
+        A, centroid = EllipseDirectFit.EllipseDirectFit(np.vstack([xdata, ydata]).T)
+        assert A[0] + A[2] > 0
+        expected.append(np.ravel(computerVision_BP.orientation(A))[0])
+    np.testing.assert_allclose(computerVision_BP.ellipse_orientations(normPower, theta1RadFinal), expected,
+                               rtol=0, atol=1e-9)
+    xdata, ydata = computerVision_BP.pol2cart(np.concatenate([theta1RadFinal, theta1RadFinal + np.pi]),
+                                              np.concatenate([normPower, normPower], axis=1))
+    A, centroid = EllipseDirectFit.EllipseDirectFitBatch(np.stack([xdata, ydata], axis=2))
+    assert np.all(A[:, 0] + A[:, 2] > 0)
+
+
+@pytest.mark.parametrize('prefix, k, mu', [('Norm Test Image_90_0.2_', 0.169282, 92.0109),
+                                           ('Norm Test Image_90_0.6_', 0.349996, 97.4086)])
+def test_even_square_image_is_analyzed_as_it_is(prefix, k, mu):
+    im = read_test_image(prefix)
+    assert im.shape == (1074, 1074)
+    conformed = preprocessing.conform_image(im)
+    np.testing.assert_array_equal(conformed, im)
+    # k and mu found before images were conformed
+    assert fit_distribution(computerVision_BP.power_spectrum(conformed), im.shape[1]) == pytest.approx((k, mu),
+                                                                                                      abs=1e-4)
+
+
+@pytest.mark.parametrize('angleInc', [1.0, 0.25])
+@pytest.mark.parametrize('prefix', ['Norm Test Image_90_0.3_', 'Norm Test Image_90_0.5_', 'Norm Test Image_90_0.7_'])
+def test_adaptive_histogram_matches_spline(prefix, angleInc):
+    im = preprocessing.conform_image(read_test_image(prefix))
+    PabsFlip = computerVision_BP.power_spectrum(im)
+    expected, theta1RadFinal = computerVision_BP.process_histogram(PabsFlip, im.shape[1], U_CUT, L_CUT, angleInc,
+                                                                   RAD_STEP)
+    normPower, theta = computerVision_BP.process_histogram_adaptive(PabsFlip, im.shape[1], U_CUT, L_CUT, angleInc,
+                                                                    RAD_STEP)
+    np.testing.assert_array_equal(theta, theta1RadFinal)
+    # the bound documented in the README
+    assert relative_error(normPower, expected) < 2e-4
+    k, mu = fit_distribution(PabsFlip, im.shape[1], angleInc)
+    assert fit_distribution(PabsFlip, im.shape[1], angleInc, 'adaptive') == pytest.approx((k, mu), abs=1e-3)
+
+
+@pytest.mark.parametrize('k', [-3.0, -0.03, 0.0, 0.5, 20.0, 800.0])
+def test_kappa_density_is_normalized_for_either_sign_of_k(k):
+    theta = np.linspace(0.0, math.pi, 20001)
+    density = computerVision_BP.kappa_density(theta, 0.3, k)
+    assert np.all(np.isfinite(density))
+    assert np.trapz(density, theta) == pytest.approx(1.0, abs=1e-6)
+    if abs(k) < 100:
+        # the normalization process_kappa computes by quadrature
+        quadrature = scipy.integrate.quad(lambda x: math.exp(k * math.cos(x)), 0.0, math.pi)[0]
+        expected = np.exp(k * np.cos(2 * (theta - 0.3))) / quadrature
+        assert relative_error(density, expected) < 1e-9
+
+
+def test_bootstrap_interval_of_negative_k_contains_k():
+    im = read_test_image('Norm Test Image_90_0.3_')
+    PabsFlip = computerVision_BP.power_spectrum(im)
+    normPower, theta1RadFinal = computerVision_BP.process_histogram(PabsFlip, im.shape[1], U_CUT, L_CUT, ANGLE_INC,
+                                                                   RAD_STEP)
+    k, t_final = fit_distribution(PabsFlip, im.shape[1])
+    assert k < 0
+    (kLow, kHigh), (tLow, tHigh) = computerVision_BP.bootstrap_distribution(normPower, theta1RadFinal, t_final, k,
+                                                                            replicates=500, seed=0)
+    assert kLow < k < kHigh < 0.05
+    assert tLow < t_final < tHigh
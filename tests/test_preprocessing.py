@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from src.fiberfit_model import preprocessing
+
+
+@pytest.mark.parametrize('shape, side', [((1074, 1074), 1074), ((1075, 1075), 1074), ((800, 600), 800),
+                                         ((1200, 1601), 1620)])
+def test_auto_keeps_every_pixel(shape, side):
+    im = np.random.default_rng(0).random(shape)
+    conformed = preprocessing.conform_image(im)
+    assert conformed.shape == (side, side) == (preprocessing.conformed_side(shape),) * 2
+    m, n = shape
+    if m == n:
+        # an odd side loses its first row and column, as before
+        np.testing.assert_array_equal(conformed, im[m % 2:, n % 2:])
+    else:
+        top, left = (side - m) // 2, (side - n) // 2
+        np.testing.assert_array_equal(conformed[top:top + m, left:left + n], im)
+        assert conformed[0, 0] == pytest.approx(im.mean())
+
+
+@pytest.mark.parametrize('mode', ['crop', 'pad'])
+def test_explicit_modes_make_fast_squares(mode):
+    shape = (1074, 1074)
+    conformed = preprocessing.conform_image(np.zeros(shape), mode)
+    side = preprocessing.conformed_side(shape, mode)
+    assert conformed.shape == (side, side)
+    assert preprocessing.is_fast_len(side)
+    assert side < 1074 if mode == 'crop' else side > 1074
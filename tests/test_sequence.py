@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.fiberfit_model import computerVision_BP
+from src.fiberfit_model import preprocessing
+from src.fiberfit_model import sequence
+from src.fiberfit_model import synthetic
+from tests.test_computerVision_BP import ANGLE_INC, L_CUT, RAD_STEP, U_CUT, fit_distribution, read_test_image
+
+FRAMES = ['Norm Test Image_90_0.6_', 'Norm Test Image_90_0.3_', 'Norm Test Image_90_0.2_']
+
+
+def full_analysis(prefix):
+    """
+    :return: k and mu of a test image as the full analysis finds them
+    """
+    im = preprocessing.conform_image(read_test_image(prefix))
+    return fit_distribution(computerVision_BP.power_spectrum(im), im.shape[1])
+
+
+@pytest.mark.parametrize('prefix', FRAMES)
+def test_first_frame_matches_full_analysis(prefix):
+    analyzer = sequence.SequenceAnalyzer(U_CUT, L_CUT, ANGLE_INC, RAD_STEP)
+    sig, k, th, R2, evaluations, latency = analyzer.analyze(read_test_image(prefix))
+    assert (k, th) == pytest.approx(full_analysis(prefix), abs=1e-4)
+
+
+def test_warm_start_follows_k_across_zero():
+    # Norm Test Image_90_0.3 has a negative k, between two frames with a positive one
+    analyzer = sequence.SequenceAnalyzer(U_CUT, L_CUT, ANGLE_INC, RAD_STEP)
+    for prefix in FRAMES:
+        sig, k, th, R2, evaluations, latency = analyzer.analyze(read_test_image(prefix))
+        assert (k, th) == pytest.approx(full_analysis(prefix), abs=1e-4)
+
+
+def test_gif_stack_is_read_as_gray_values(tmp_path):
+    # palette frames whose palette indices are not their gray values
+    palette = np.random.default_rng(0).permutation(256).astype(np.uint8)
+    indices = [np.round(255 * synthetic.fiber_image(64, mu, 4, seed=1)).astype(np.uint8) for mu in (30, 60, 90)]
+    images = []
+    for values in indices:
+        image = Image.fromarray(values).convert('P')
+        image.putpalette(np.repeat(palette, 3).tolist())
+        images.append(image)
+    path = tmp_path / 'stack.gif'
+    images[0].save(path, save_all=True, append_images=images[1:])
+    read = list(sequence.iter_frames([path]))
+    assert [index for source, index, frame in read] == [0, 1, 2]
+    for (source, index, frame), expected in zip(read, indices):
+        np.testing.assert_array_equal(frame, palette[expected])
+
+
+def test_alpha_is_not_averaged_in(tmp_path):
+    gray = np.round(255 * synthetic.fiber_image(64, 45, 4, seed=2)).astype(np.uint8)
+    path = tmp_path / 'frame.png'
+    Image.fromarray(np.stack([gray, np.full_like(gray, 255)], axis=2), mode='LA').save(path)
+    (source, index, frame), = sequence.iter_frames([path])
+    np.testing.assert_array_equal(frame, gray)